@@ -0,0 +1,96 @@
+import json
+import os
+import typing as t
+from pathlib import Path
+
+# Botocore and boto3 data files that don't belong to a single service, like endpoints.json and _retry.json
+GLOBAL_DATA = "_global"
+
+
+def classify(relative_path: t.Union[str, Path]) -> t.Tuple[str, str]:
+    """Return ("services", name) for model data and ("packages", name) for everything else in site-packages"""
+    parts = Path(relative_path).parts
+    if len(parts) > 2 and parts[0] in ("botocore", "boto3") and parts[1] == "data":
+        return "services", parts[2] if len(parts) > 3 else GLOBAL_DATA
+    if parts[0].endswith(".dist-info"):
+        return "packages", parts[0].split("-")[0]
+    return "packages", parts[0][: -len(".py")] if parts[0].endswith(".py") else parts[0]
+
+
+def human_size(nbytes: int) -> str:
+    size = float(nbytes)
+    for unit in ("B", "K", "M"):
+        if size < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}G"
+
+
+class SizeLedger:
+    """Byte and file counts per stage, per service and per package
+
+    Stages record sizes of files they are already reading or writing, so accounting never walks a tree on
+    its own. The result is persisted next to the layer as <layer>.sizes.json.
+    """
+
+    def __init__(self, stages=None):
+        self.stages: t.Dict[str, t.Dict[str, t.Dict[str, t.List[int]]]] = stages or {}
+
+    def record(self, stage: str, relative_path, nbytes: int):
+        kind, name = classify(relative_path)
+        counts = self.stages.setdefault(stage, {}).setdefault(kind, {}).setdefault(name, [0, 0])
+        counts[0] += 1
+        counts[1] += nbytes
+
+    def resize(self, stage: str, relative_path, delta: int):
+        """Change the bytes recorded under `stage` for a file that was already counted there"""
+        kind, name = classify(relative_path)
+        self.stages[stage][kind][name][1] += delta
+
+    def clear(self, stage: str):
+        self.stages.pop(stage, None)
+
+    def total(self, stage: str, kind: t.Optional[str] = None) -> int:
+        kinds = self.stages.get(stage, {})
+        return sum(counts[1] for k, names in kinds.items() if kind in (None, k) for counts in names.values())
+
+    def layer_size(self, stage: str) -> int:
+        """Size of the whole layer with model data as of `stage` and code as copied into the layer"""
+        if stage == "pruned":
+            return self.total("pruned")
+        return self.total("pruned", "packages") + self.total(stage, "services")
+
+    def to_json(self) -> dict:
+        report = {}
+        for stage, kinds in self.stages.items():
+            report[stage] = {
+                "total": {
+                    "files": sum(c[0] for names in kinds.values() for c in names.values()),
+                    "bytes": sum(c[1] for names in kinds.values() for c in names.values()),
+                },
+                **{
+                    kind: {name: {"files": c[0], "bytes": c[1]} for name, c in sorted(names.items(), key=lambda i: -i[1][1])}
+                    for kind, names in sorted(kinds.items())
+                },
+            }
+        return report
+
+    def write(self, path: Path):
+        with open(path, "w") as f:
+            json.dump(self.to_json(), f, indent=2)
+
+    @classmethod
+    def load(cls, path: Path) -> "SizeLedger":
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            report = json.load(f)
+        stages = {
+            stage: {kind: {name: [c["files"], c["bytes"]] for name, c in names.items()} for kind, names in kinds.items() if kind != "total"}
+            for stage, kinds in report.items()
+        }
+        return cls(stages)
+
+
+def ledger_path(layer_root: Path) -> Path:
+    return Path(layer_root).with_name(Path(layer_root).name + ".sizes.json")
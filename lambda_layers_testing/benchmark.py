@@ -0,0 +1,336 @@
+import json
+import statistics
+import sys
+import typing as t
+from pathlib import Path
+from subprocess import check_output, run
+
+from .accounting import human_size
+
+
+class Workload(t.NamedTuple):
+    """Clients a cold process creates: `sessions` boto3 Sessions each making a client per service"""
+
+    services: t.Tuple[str, ...]
+    sessions: int = 1
+
+
+DEFAULT_WORKLOADS = {
+    "sts": Workload(("sts",)),
+    # what perf_dummy.py runs
+    "perf-dummy": Workload(("ec2", "firehose", "iam"), sessions=20),
+}
+METRICS = ("import_seconds", "first_client_seconds", "total_seconds", "max_rss_kb")
+
+# Run with -I -S, so only the standard library and the layer under test are importable, and with -B so the
+# probe never writes bytecode into the layer it measures
+_PROBE = """
+import json, resource, sys, time
+config = json.loads(sys.argv[1])
+sys.path.insert(0, config['path'])
+start = time.perf_counter()
+import boto3
+imported = time.perf_counter()
+first_client = None
+for _ in range(config['sessions']):
+    session = boto3.Session(region_name=config['region'])
+    for service in config['services']:
+        session.client(service)
+        first_client = first_client or time.perf_counter()
+print(json.dumps({
+    'import_seconds': imported - start,
+    'first_client_seconds': first_client - imported,
+    'total_seconds': time.perf_counter() - start,
+    'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+}))
+"""
+
+
+def runtime_of(python: str) -> str:
+    return check_output([python, "-I", "-S", "-c", "import sys; print('python%d.%d' % sys.version_info[:2])"]).decode().strip()
+
+
+def probe(python: str, site_packages: Path, workload: Workload, region: str = "us-west-2") -> t.Dict[str, float]:
+    """Run one workload in a fresh isolated interpreter and return its timings and peak RSS"""
+    config = {"path": str(site_packages), "services": list(workload.services), "sessions": workload.sessions, "region": region}
+    return json.loads(check_output([python, "-I", "-S", "-B", "-c", _PROBE, json.dumps(config)]))
+
+
+def summarize(samples: t.List[float]) -> t.Dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        "median": statistics.median(ordered),
+        "p95": ordered[min(len(ordered) - 1, round(0.95 * (len(ordered) - 1)))],
+        "stddev": statistics.stdev(ordered) if len(ordered) > 1 else 0.0,
+    }
+
+
+def benchmark_variants(
+    variants: t.Dict[str, Path],
+    workloads: t.Dict[str, Workload] = None,
+    runs: int = 20,
+    warmup: int = 1,
+    python: str = sys.executable,
+    region: str = "us-west-2",
+    report_path: Path = None,
+) -> dict:
+    """Cold-start every layer variant `runs` times per workload and report median, p95 and stddev
+
+    Variants are interleaved run by run so drift on the machine spreads evenly over them, and `warmup`
+    runs per variant are discarded to get the layer into the page cache.
+    """
+    workloads = workloads or DEFAULT_WORKLOADS
+    runtime = runtime_of(python)
+    site_packages = {label: Path(root).resolve() / "python" / "lib" / runtime / "site-packages" for label, root in variants.items()}
+    samples = {label: {name: {m: [] for m in METRICS} for name in workloads} for label in variants}
+    for iteration in range(warmup + runs):
+        for name, workload in workloads.items():
+            for label in variants:
+                result = probe(python, site_packages[label], workload, region)
+                if iteration < warmup:
+                    continue
+                for metric in METRICS:
+                    samples[label][name][metric].append(result[metric])
+
+    report = {
+        "runtime": runtime,
+        "runs": runs,
+        "workloads": {name: workload._asdict() for name, workload in workloads.items()},
+        "variants": {
+            label: {name: {metric: summarize(values) for metric, values in by_metric.items()} for name, by_metric in by_workload.items()}
+            for label, by_workload in samples.items()
+        },
+    }
+    if report_path is not None:
+        Path(report_path).parent.mkdir(parents=True, exist_ok=True)
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+    print(comparison_table(report))
+    return report
+
+
+def comparison_table(report: dict) -> str:
+    """Variants ranked by median total time per workload, in milliseconds"""
+    lines = []
+    for name in report["workloads"]:
+        ranked = sorted(report["variants"], key=lambda label: report["variants"][label][name]["total_seconds"]["median"])
+        fastest = report["variants"][ranked[0]][name]["total_seconds"]["median"]
+        width = max(len("variant"), *(len(label) for label in ranked))
+        lines.append(f"{name} ({report['runtime']}, {report['runs']} runs)")
+        lines.append(
+            f"{'variant':<{width}}  {'import':>8}  {'client':>8}  {'total':>8}  {'p95':>8}  {'stddev':>7}  {'vs best':>7}  {'rss':>7}"
+        )
+        for label in ranked:
+            stats = report["variants"][label][name]
+            total = stats["total_seconds"]
+            lines.append(
+                f"{label:<{width}}  {1000 * stats['import_seconds']['median']:>8.1f}"
+                f"  {1000 * stats['first_client_seconds']['median']:>8.1f}"
+                f"  {1000 * total['median']:>8.1f}  {1000 * total['p95']:>8.1f}  {1000 * total['stddev']:>7.1f}"
+                f"  {total['median'] / fastest:>6.2f}x  {human_size(1024 * stats['max_rss_kb']['median']):>7}"
+            )
+        lines.append("")
+    return "\n".join(lines)
+
+
+# Counts file opens, listings and os.stat calls under the layer and times every model file load. The import
+# system stats through its own bindings, so module lookups show up in -X importtime instead.
+_IO_PROBE = """
+import collections, json, os, sys, time
+config = json.loads(sys.argv[1])
+root = config['path']
+sys.path.insert(0, root)
+io = collections.defaultdict(collections.Counter)
+def relative(path):
+    path = os.fsdecode(path) if isinstance(path, (str, bytes, os.PathLike)) else None
+    return os.path.relpath(path, root) if path and os.path.abspath(path).startswith(root + os.sep) else None
+def audit(event, args):
+    kind = {'open': 'open', 'os.listdir': 'listdir', 'os.scandir': 'listdir'}.get(event)
+    if kind and relative(args[0]):
+        io[relative(args[0])][kind] += 1
+sys.addaudithook(audit)
+real_stat = os.stat
+def counting_stat(path, *args, **kwargs):
+    if relative(path):
+        io[relative(path)]['stat'] += 1
+    return real_stat(path, *args, **kwargs)
+os.stat = counting_stat
+import botocore.loaders
+models = collections.defaultdict(float)
+file_loader = botocore.loaders.Loader.FILE_LOADER_CLASS
+real_load_file = file_loader.load_file
+def timed_load_file(self, file_path):
+    start = time.perf_counter()
+    try:
+        return real_load_file(self, file_path)
+    finally:
+        models[os.path.relpath(file_path, root)] += time.perf_counter() - start
+file_loader.load_file = timed_load_file
+import boto3
+for _ in range(config['sessions']):
+    session = boto3.Session(region_name=config['region'])
+    for service in config['services']:
+        session.client(service)
+print(json.dumps({'io': io, 'models': models}))
+"""
+
+
+def _parse_importtime(stderr: str) -> t.Dict[str, t.Tuple[int, int]]:
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:") :].split("|")
+        modules[module.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def profile_variant(
+    layer_root: Path, workload: Workload = DEFAULT_WORKLOADS["perf-dummy"], runs: int = 5, python: str = sys.executable, region="us-west-2"
+) -> dict:
+    """Per-module import time and per-file I/O for one layer variant, medians over `runs` fresh interpreters
+
+    Module times come from -X importtime. File I/O counts opens, listings and stats under the layer's
+    site-packages, and model load times are keyed by extensionless path so encodings compare directly.
+    """
+    site_packages = Path(layer_root).resolve() / "python" / "lib" / runtime_of(python) / "site-packages"
+    config = {"path": str(site_packages), "services": list(workload.services), "sessions": workload.sessions, "region": region}
+    modules, models, io = {}, {}, {}
+    for _ in range(runs):
+        result = run(
+            [python, "-I", "-S", "-B", "-X", "importtime", "-c", _IO_PROBE, json.dumps(config)], capture_output=True, text=True, check=True
+        )
+        for module, times in _parse_importtime(result.stderr).items():
+            modules.setdefault(module, []).append(times)
+        output = json.loads(result.stdout)
+        for key, seconds in output["models"].items():
+            models.setdefault(key, []).append(seconds)
+        # I/O is deterministic, one run describes it
+        io = io or output["io"]
+    return {
+        "workload": workload._asdict(),
+        "modules": {
+            module: {
+                "self_us": statistics.median(s for s, _ in times),
+                "cumulative_us": statistics.median(c for _, c in times),
+            }
+            for module, times in modules.items()
+        },
+        "models": {key: {"load_seconds": statistics.median(times)} for key, times in sorted(models.items())},
+        "files": {path: dict(counts) for path, counts in sorted(io.items())},
+        "totals": {
+            "import_us": sum(statistics.median(s for s, _ in times) for times in modules.values()),
+            "model_load_seconds": sum(statistics.median(times) for times in models.values()),
+            **{kind: sum(counts.get(kind, 0) for counts in io.values()) for kind in ("open", "stat", "listdir")},
+        },
+    }
+
+
+def profile_variants(variants: t.Dict[str, Path], report_dir: Path, **kwargs) -> t.Dict[str, dict]:
+    """Profile each variant and write it to <report_dir>/<variant>.profile.json"""
+    Path(report_dir).mkdir(parents=True, exist_ok=True)
+    profiles = {}
+    for label, root in variants.items():
+        profiles[label] = profile_variant(root, **kwargs)
+        with open(Path(report_dir) / f"{label}.profile.json", "w") as f:
+            json.dump(profiles[label], f, indent=2)
+    return profiles
+
+
+def _deltas(before: t.Dict[str, dict], after: t.Dict[str, dict], field: str) -> t.List[t.Tuple[str, float, float]]:
+    rows = [(key, before.get(key, {}).get(field, 0), after.get(key, {}).get(field, 0)) for key in set(before) | set(after)]
+    return sorted((row for row in rows if row[1] != row[2]), key=lambda row: -abs(row[2] - row[1]))
+
+
+def diff_profiles(before: dict, after: dict, top: int = 20) -> dict:
+    """Modules, model files and files on disk whose cost changed the most between two variant profiles"""
+    io_kinds = ("open", "stat", "listdir")
+    diff = {
+        "totals": {k: {"before": before["totals"][k], "after": after["totals"][k]} for k in before["totals"]},
+        "modules": _deltas(before["modules"], after["modules"], "self_us"),
+        "models": _deltas(before["models"], after["models"], "load_seconds"),
+        "files": _deltas(
+            {path: {"calls": sum(counts.get(k, 0) for k in io_kinds)} for path, counts in before["files"].items()},
+            {path: {"calls": sum(counts.get(k, 0) for k in io_kinds)} for path, counts in after["files"].items()},
+            "calls",
+        ),
+    }
+    for name, totals in diff["totals"].items():
+        print(f"{name}: {totals['before']:.6g} -> {totals['after']:.6g}")
+    for section, unit, scale in (("modules", "us self", 1), ("models", "ms to load", 1000), ("files", "calls", 1)):
+        print(f"\n{section} ({unit})")
+        for key, was, now in diff[section][:top]:
+            print(f"  {scale * was:>10.1f} -> {scale * now:>10.1f}  {key}")
+    return diff
+
+
+# Steps through one service in a fresh interpreter, recording RSS (from /proc/self/statm, Linux only) and
+# the bytes tracemalloc sees allocated after each step
+_MEMORY_PROBE = """
+import gc, json, os, sys, tracemalloc
+config = json.loads(sys.argv[1])
+sys.path.insert(0, config['path'])
+def rss_kb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+steps = {}
+def step(name):
+    gc.collect()
+    steps[name] = {'rss_kb': rss_kb(), 'traced_bytes': tracemalloc.get_traced_memory()[0]}
+tracemalloc.start()
+import boto3
+session = boto3.Session(region_name=config['region'])
+loader = session._session.get_component('data_loader')
+step('session')
+model = loader.load_service_model(config['service'], 'service-2')
+step('model')
+del model
+client = session.client(config['service'])
+step('client')
+del client
+step('client_released')
+print(json.dumps(steps))
+"""
+MEMORY_STEPS = ("session", "model", "client", "client_released")
+
+
+def _signed_size(nbytes: int) -> str:
+    return ("-" if nbytes < 0 else "+") + human_size(abs(nbytes))
+
+
+def profile_memory(
+    layer_root: Path, services=("ec2", "firehose", "iam"), python: str = sys.executable, region: str = "us-west-2", report_path: Path = None
+) -> dict:
+    """RSS and traced allocations per service: loading its model, creating its client, and after dropping the client
+
+    Each service runs in a fresh interpreter under tracemalloc, which slows it down and adds its own
+    overhead to RSS, so compare RSS between variants rather than against benchmark_variants. Deltas are
+    relative to the previous step, and "client_released" is what the session still holds once the client
+    is gone.
+    """
+    site_packages = Path(layer_root).resolve() / "python" / "lib" / runtime_of(python) / "site-packages"
+    report = {}
+    for service in services:
+        config = {"path": str(site_packages), "service": service, "region": region}
+        steps = json.loads(check_output([python, "-I", "-S", "-B", "-c", _MEMORY_PROBE, json.dumps(config)]))
+        report[service] = {
+            name: {
+                "rss_kb": steps[name]["rss_kb"],
+                "traced_bytes": steps[name]["traced_bytes"],
+                "rss_delta_kb": steps[name]["rss_kb"] - steps[previous]["rss_kb"],
+                "traced_delta_bytes": steps[name]["traced_bytes"] - steps[previous]["traced_bytes"],
+            }
+            for previous, name in zip(MEMORY_STEPS, MEMORY_STEPS[1:])
+        }
+        print(
+            f"{service}: "
+            + ", ".join(
+                f"{name} {_signed_size(1024 * step['rss_delta_kb'])} rss / {_signed_size(step['traced_delta_bytes'])} traced"
+                for name, step in report[service].items()
+            )
+        )
+    if report_path is not None:
+        Path(report_path).parent.mkdir(parents=True, exist_ok=True)
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
@@ -0,0 +1,146 @@
+import ast
+import os
+import typing as t
+from pathlib import Path
+
+# boto3 and botocore entry points that take a service name as their first argument
+SERVICE_METHODS = {"client", "resource", "create_client"}
+# services every layer keeps: the default credential chain calls sts for assume-role profiles and web
+# identity tokens
+ALWAYS_KEEP = ("sts",)
+# names accepted by Session.client that botocore maps onto another service directory
+SERVICE_ALIASES = {"runtime.sagemaker": "sagemaker-runtime"}
+# calls returning a session whose client/resource/create_client take a service name
+SESSION_FACTORIES = {"boto3.Session", "boto3.session.Session", "botocore.session.Session", "botocore.session.get_session"}
+# module-level shortcuts onto the default session
+MODULE_METHODS = {"boto3.client", "boto3.resource"}
+
+
+class ServiceCall(t.NamedTuple):
+    filename: str
+    lineno: int
+    service: t.Optional[str]
+
+
+def _service_argument(call: ast.Call) -> t.Optional[ast.expr]:
+    if call.args:
+        return call.args[0]
+    return next((kw.value for kw in call.keywords if kw.arg == "service_name"), None)
+
+
+def _dotted(node: ast.expr) -> t.Optional[str]:
+    """`a.b.c` for a chain of attributes on a name, None for anything else"""
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        parent = _dotted(node.value)
+        return f"{parent}.{node.attr}" if parent else None
+    return None
+
+
+def _imported_names(tree: ast.Module) -> t.Dict[str, str]:
+    """Local names bound by boto3 and botocore imports, mapped to what they refer to"""
+    names = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.name.split(".")[0] in ("boto3", "botocore"):
+                    # import a.b binds a; import a.b as c binds c to a.b
+                    names[alias.asname or alias.name.split(".")[0]] = alias.name if alias.asname else alias.name.split(".")[0]
+        elif isinstance(node, ast.ImportFrom) and node.module and node.module.split(".")[0] in ("boto3", "botocore"):
+            for alias in node.names:
+                names[alias.asname or alias.name] = f"{node.module}.{alias.name}"
+    return names
+
+
+class _Boto3Receivers:
+    """Decides whether an expression is boto3, botocore's session module or a session made by them"""
+
+    def __init__(self, tree: ast.Module):
+        self.imports = _imported_names(tree)
+        self.sessions: t.Set[str] = set()
+        # sessions bound to a name or attribute, and parameters annotated as sessions; order doesn't matter
+        # since a binding anywhere in the file marks the name
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Assign) and self.is_session(node.value):
+                self.sessions.update(filter(None, map(_dotted, node.targets)))
+            elif isinstance(node, ast.AnnAssign) and (
+                (node.value is not None and self.is_session(node.value)) or self.qualified(node.annotation) in SESSION_FACTORIES
+            ):
+                self.sessions.add(_dotted(node.target))
+            elif isinstance(node, ast.arg) and node.annotation is not None and self.qualified(node.annotation) in SESSION_FACTORIES:
+                self.sessions.add(node.arg)
+        self.sessions.discard(None)
+
+    def qualified(self, node: ast.expr) -> t.Optional[str]:
+        dotted = _dotted(node)
+        if dotted is None:
+            return None
+        root, _, rest = dotted.partition(".")
+        if root not in self.imports:
+            return None
+        return f"{self.imports[root]}.{rest}" if rest else self.imports[root]
+
+    def is_session(self, node: ast.expr) -> bool:
+        return isinstance(node, ast.Call) and self.qualified(node.func) in SESSION_FACTORIES
+
+    def makes_clients(self, call: ast.Call) -> bool:
+        if isinstance(call.func, ast.Name):
+            return self.qualified(call.func) in MODULE_METHODS
+        if not (isinstance(call.func, ast.Attribute) and call.func.attr in SERVICE_METHODS):
+            return False
+        receiver = call.func.value
+        return self.qualified(receiver) == "boto3" or self.is_session(receiver) or _dotted(receiver) in self.sessions
+
+
+def find_service_calls(source: str, filename: str = "<string>") -> t.List[ServiceCall]:
+    """Find client/resource/create_client calls in Python source
+
+    Only calls on boto3 itself, on a session from SESSION_FACTORIES, or on a name or attribute such a
+    session was assigned to (or a parameter annotated as one) count, so another library's .client()
+    isn't mistaken for boto3. Calls with a literal service name record it; calls whose service name is
+    computed record None, so a caller can point at code the analysis can't see through.
+    """
+    tree = ast.parse(source, filename)
+    receivers = _Boto3Receivers(tree)
+    calls = []
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and receivers.makes_clients(node)):
+            continue
+        argument = _service_argument(node)
+        if argument is None:
+            continue
+        service = argument.value if isinstance(argument, ast.Constant) and isinstance(argument.value, str) else None
+        calls.append(ServiceCall(filename, node.lineno, SERVICE_ALIASES.get(service, service)))
+    return calls
+
+
+def _python_files(path: Path):
+    if path.is_file():
+        yield path
+        return
+    for parent, _, files in os.walk(path):
+        yield from (Path(parent) / f for f in files if f.endswith(".py"))
+
+
+def services_for_handlers(paths, extra_services=(), allow_dynamic: bool = False) -> t.List[str]:
+    """The minimal only_services for handler code under `paths`, which can be files or source trees
+
+    Raises ValueError when a client or resource is created with a service name that isn't a literal,
+    since the layer could be missing that service at runtime. List those in `extra_services` and set
+    `allow_dynamic`.
+    """
+    if isinstance(paths, (str, Path)):
+        paths = [paths]
+    services = set(ALWAYS_KEEP) | set(extra_services)
+    unresolved = []
+    for path in paths:
+        for source_file in _python_files(Path(path)):
+            for call in find_service_calls(source_file.read_text(), str(source_file)):
+                if call.service is None:
+                    unresolved.append(f"{call.filename}:{call.lineno}")
+                else:
+                    services.add(call.service)
+    if unresolved and not allow_dynamic:
+        raise ValueError(f"Can't determine the service used at {', '.join(unresolved)}; list it in extra_services")
+    return sorted(services)
@@ -0,0 +1,279 @@
+import base64
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import typing as t
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from email.parser import HeaderParser
+from pathlib import Path
+from subprocess import check_output
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from packaging.markers import default_environment
+from packaging.requirements import Requirement
+from packaging.specifiers import SpecifierSet
+from packaging.utils import canonicalize_name, parse_wheel_filename
+from packaging.version import Version
+
+CACHE_DIR = Path(os.environ.get("LAYER_CACHE_DIR", Path.home() / ".cache" / "lambda-layers-testing"))
+# wheels of boto3 and its dependencies; pip only runs to fill it, never when everything needed is here
+WHEEL_DIR = Path(os.environ.get("LAYER_WHEEL_DIR", CACHE_DIR / "wheels"))
+# sha256 of every wheel in the wheelhouse that passed verification, so later offline installs can check it
+HASHES_NAME = "verified-hashes.json"
+OFFLINE = bool(os.environ.get("LAYER_OFFLINE"))
+# a requirements file pinning wheels with --hash=sha256:..., as pip-compile --generate-hashes writes
+HASHES_FILE = os.environ.get("LAYER_HASHES")
+# accept a wheel nothing else vouches for the first time it is seen; the opt-in for trust on first use
+TRUST_NEW_WHEELS = bool(os.environ.get("LAYER_TRUST_NEW_WHEELS"))
+# the index pip downloads from, whose links carry the sha256 PyPI computed at upload
+PYPI_SIMPLE = "https://pypi.org/simple/{name}/"
+INSTALL_ROOT = Path("/tmp")
+# the platform Lambda runs; every wheel boto3 needs is pure Python, so this only keeps pip off sdists
+PLATFORM = "manylinux2014_x86_64"
+
+# boto3 None resolves to the newest release supporting the target pythons once per process
+_latest: t.Dict[t.Tuple[str, ...], str] = {}
+
+
+class Wheel(t.NamedTuple):
+    name: str
+    version: Version
+    path: Path
+
+
+def _wheels(wheelhouse: Path) -> t.Dict[str, t.List[Wheel]]:
+    """Pure Python wheels in the wheelhouse by canonical project name, newest first"""
+    found = {}
+    for path in wheelhouse.glob("*.whl"):
+        name, version, _, tags = parse_wheel_filename(path.name)
+        if any(tag.abi == "none" and tag.platform == "any" and tag.interpreter.startswith("py3") for tag in tags):
+            found.setdefault(name, []).append(Wheel(name, version, path))
+    return {name: sorted(wheels, key=lambda w: w.version, reverse=True) for name, wheels in found.items()}
+
+
+def _metadata(wheel: Wheel):
+    with zipfile.ZipFile(wheel.path) as archive:
+        return HeaderParser().parsestr(archive.read(f"{_dist_info(archive)}/METADATA").decode())
+
+
+def _requirements(wheel: Wheel) -> t.List[Requirement]:
+    return [Requirement(r) for r in _metadata(wheel).get_all("Requires-Dist") or []]
+
+
+def _supports(wheel: Wheel, python_versions: t.List[str]) -> bool:
+    """Whether the wheel's Requires-Python admits every one of `python_versions`"""
+    requires_python = SpecifierSet(_metadata(wheel).get("Requires-Python") or "")
+    return all(f"{v}.0" in requires_python for v in python_versions)
+
+
+def _dist_info(archive: zipfile.ZipFile) -> str:
+    return next(n.split("/")[0] for n in archive.namelist() if n.split("/")[0].endswith(".dist-info"))
+
+
+def _target_versions(python_versions=None) -> t.List[str]:
+    return sorted(set(python_versions or ["%d.%d" % sys.version_info[:2]]))
+
+
+def resolve(boto3_version=None, wheelhouse: Path = WHEEL_DIR, python_versions=None) -> t.Dict[str, Wheel]:
+    """Pick a wheel for boto3 and each of its dependencies from the wheelhouse
+
+    Requirements are followed breadth first, and for every project the newest wheel meeting all specifiers
+    seen so far wins. Environment markers and Requires-Python are checked against each of `python_versions`
+    (the running interpreter's by default), so one set of wheels serves every runtime of a layer. Extras are
+    never installed. Raises LookupError when the wheelhouse can't satisfy a requirement.
+    """
+    python_versions = _target_versions(python_versions)
+    environments = [{**default_environment(), "python_version": v, "python_full_version": f"{v}.0", "extra": ""} for v in python_versions]
+    available = _wheels(wheelhouse)
+    pending = [Requirement(f"boto3=={boto3_version}" if boto3_version else "boto3")]
+    specifiers, chosen = {}, {}
+    while pending:
+        requirement = pending.pop(0)
+        if requirement.marker is not None and not any(requirement.marker.evaluate(env) for env in environments):
+            continue
+        name = canonicalize_name(requirement.name)
+        specifiers.setdefault(name, []).append(requirement.specifier)
+        wheel = next(
+            (w for w in available.get(name, []) if all(w.version in s for s in specifiers[name]) and _supports(w, python_versions)),
+            None,
+        )
+        if wheel is None:
+            raise LookupError(
+                f"no wheel in {wheelhouse} satisfies {name}{','.join(map(str, specifiers[name]))} on python {', '.join(python_versions)}"
+            )
+        if chosen.get(name) != wheel:
+            chosen[name] = wheel
+            pending.extend(_requirements(wheel))
+    return chosen
+
+
+def download(requirement: str, wheelhouse: Path = WHEEL_DIR, python_versions=None):
+    """Fill the wheelhouse with pip, the only time it runs
+
+    pip resolves for one interpreter at a time, so it runs once for each of `python_versions`, whose
+    markers and Requires-Python can pick different wheels.
+    """
+    wheelhouse.mkdir(parents=True, exist_ok=True)
+    command = [sys.executable, "-m", "pip", "download", "-q", "--only-binary", ":all:", "--platform", PLATFORM, "--dest", str(wheelhouse)]
+    for version in _target_versions(python_versions):
+        check_output([*command, "--python-version", version, requirement], cwd=wheelhouse)
+
+
+def read_pins(path) -> t.Dict[t.Tuple[str, Version], t.Set[str]]:
+    """The sha256 digests a requirements file allows for each pinned name==version"""
+    pins = {}
+    # backslash continuations put a requirement's --hash options on lines of their own
+    for line in Path(path).read_text().replace("\\\n", " ").splitlines():
+        tokens = line.split("#", 1)[0].split()
+        if not tokens or tokens[0].startswith("-"):
+            continue
+        requirement = Requirement(tokens[0])
+        version = next((Version(s.version) for s in requirement.specifier if s.operator in ("==", "===")), None)
+        if version is None:
+            raise ValueError(f"{path}: {tokens[0]} isn't pinned to a version")
+        digests = {token.split(":", 1)[1] for token in tokens[1:] if token.startswith("--hash=sha256:")}
+        pins.setdefault((canonicalize_name(requirement.name), version), set()).update(digests)
+    return pins
+
+
+def pypi_digests(wheel: Wheel) -> t.Set[str]:
+    """The sha256 PyPI publishes for this wheel's file, empty when PyPI doesn't know it"""
+    try:
+        with urlopen(PYPI_SIMPLE.format(name=wheel.name), timeout=30) as response:
+            index = response.read().decode()
+    except HTTPError as e:
+        if e.code == 404:
+            return set()
+        raise
+    return set(re.findall(rf'href="[^"#]*/{re.escape(wheel.path.name)}#sha256=([0-9a-f]{{64}})"', index))
+
+
+def verify(wheels, wheelhouse: Path = WHEEL_DIR, pins=None, pypi: bool = not OFFLINE, trust_new: bool = TRUST_NEW_WHEELS):
+    """Check each wheel's sha256 against a source other than the wheelhouse itself
+
+    The expected digest comes from `pins` (see read_pins), else from an earlier verification recorded in the
+    wheelhouse's verified-hashes.json, else from PyPI's index with `pypi`. A wheel none of them
+    vouch for raises ValueError unless `trust_new` accepts it as it is. Verified digests are recorded.
+    """
+    hashes_path = wheelhouse / HASHES_NAME
+    known = json.loads(hashes_path.read_text()) if hashes_path.exists() else {}
+    recorded = dict(known)
+    for wheel in wheels:
+        digest = hashlib.sha256(wheel.path.read_bytes()).hexdigest()
+        expected = (pins or {}).get((wheel.name, wheel.version))
+        source = "the pinned hashes"
+        if not expected and wheel.path.name in known:
+            expected, source = {known[wheel.path.name]}, str(hashes_path)
+        if not expected and pypi:
+            expected, source = pypi_digests(wheel), "PyPI"
+        if not expected:
+            if not trust_new:
+                raise ValueError(
+                    f"nothing vouches for {wheel.path}: pin its sha256 in LAYER_HASHES, allow PyPI lookups by going online, "
+                    "or set LAYER_TRUST_NEW_WHEELS to accept it as it is"
+                )
+            expected = {digest}
+        if digest not in expected:
+            raise ValueError(f"{wheel.path} doesn't match its sha256 from {source}")
+        recorded[wheel.path.name] = digest
+    if recorded != known:
+        tmp = hashes_path.with_name(f".{HASHES_NAME}.{os.getpid()}")
+        tmp.write_text(json.dumps(recorded, indent=2, sort_keys=True))
+        os.replace(tmp, hashes_path)
+
+
+def _record_hash(payload: bytes) -> str:
+    return "sha256=" + base64.urlsafe_b64encode(hashlib.sha256(payload).digest()).rstrip(b"=").decode()
+
+
+def extract(wheel: Wheel, target: Path):
+    """Unpack a wheel as pip install -t would, checking every file against the wheel's RECORD"""
+    with zipfile.ZipFile(wheel.path) as archive:
+        dist_info = _dist_info(archive)
+        data_dir = dist_info[: -len(".dist-info")] + ".data"
+        record = {row[0]: row[1] for row in csv.reader(io.StringIO(archive.read(f"{dist_info}/RECORD").decode())) if row}
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            name = info.filename
+            if name.startswith(data_dir + "/"):
+                scheme, _, rest = name[len(data_dir) + 1 :].partition("/")
+                if scheme not in ("purelib", "platlib", "scripts"):
+                    continue
+                name = f"bin/{rest}" if scheme == "scripts" else rest
+            payload = archive.read(info)
+            if record.get(info.filename) and _record_hash(payload) != record[info.filename]:
+                raise ValueError(f"{info.filename} in {wheel.path} doesn't match its RECORD hash")
+            path = target / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(payload)
+            if info.external_attr >> 16 & 0o111 or name.startswith("bin/"):
+                path.chmod(0o755)
+        (target / dist_info / "INSTALLER").write_text("lambda-layers-testing\n")
+
+
+def install(
+    boto3_version=None,
+    wheelhouse: Path = WHEEL_DIR,
+    offline: bool = OFFLINE,
+    python_versions=None,
+    hashes=HASHES_FILE,
+    trust_new_wheels: bool = TRUST_NEW_WHEELS,
+) -> Path:
+    """Install boto3 into INSTALL_ROOT/pkg_boto3_<version>-py<python versions> from the wheelhouse
+
+    Dependencies are resolved for every X.Y in `python_versions`, the running interpreter's by default,
+    and the tree is named after them too, since environment markers can pin different wheels per runtime.
+    Without `offline`, pip downloads whatever the wheelhouse lacks, and boto3_version None asks pip for the
+    newest release every one of them supports, once per process. The tree is named after the resolved version, so "latest" moves on
+    when a release comes out. Wheels are verified against the requirements file `hashes` or PyPI (see
+    verify) and extracted in parallel into a staging directory that is renamed into place, so an
+    interrupted install is never reused.
+    """
+    targets = tuple(_target_versions(python_versions))
+    if boto3_version is None and not offline:
+        if targets not in _latest:
+            download("boto3", wheelhouse, targets)
+            _latest[targets] = str(next(w.version for w in _wheels(wheelhouse)["boto3"] if _supports(w, targets)))
+        boto3_version = _latest[targets]
+    try:
+        wheels = resolve(boto3_version, wheelhouse, targets)
+    except LookupError:
+        if offline:
+            raise
+        download(f"boto3=={boto3_version}" if boto3_version else "boto3", wheelhouse, targets)
+        wheels = resolve(boto3_version, wheelhouse, targets)
+
+    package_dir = INSTALL_ROOT / f"pkg_boto3_{wheels['boto3'].version}-py{'-'.join(targets)}"
+    if package_dir.exists():
+        return package_dir
+    verify(wheels.values(), wheelhouse, read_pins(hashes) if hashes else None, pypi=not offline, trust_new=trust_new_wheels)
+    staging = package_dir.with_name(f".{package_dir.name}.{os.getpid()}")
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+    with ThreadPoolExecutor(len(wheels)) as pool:
+        list(pool.map(extract, wheels.values(), [staging] * len(wheels)))
+    try:
+        staging.rename(package_dir)
+    except OSError:
+        # another build installed the same version first
+        shutil.rmtree(staging)
+    print(f"Installed {', '.join(f'{w.name}=={w.version}' for w in wheels.values())} from {wheelhouse}")
+    return package_dir
+
+
+def check_installed(versions: t.Dict[str, str], python_versions=None, wheelhouse: Path = WHEEL_DIR):
+    """Raise ValueError unless `versions`, by project, are what resolve picks for `python_versions`"""
+    expected = {name: str(wheel.version) for name, wheel in resolve(versions["boto3"], wheelhouse, python_versions).items()}
+    installed = {canonicalize_name(name): version for name, version in versions.items()}
+    if installed != expected:
+        raise ValueError(
+            f"packages {installed} were not resolved for python {', '.join(_target_versions(python_versions))}, which needs {expected}"
+        )
@@ -1,11 +1,13 @@
 import json
+from functools import partial
 
 from aws_cdk import RemovalPolicy
 from aws_cdk import aws_ssm as ssm
 from aws_cdk.aws_lambda import Code, LayerVersion, Runtime, RuntimeFamily
 from constructs import Construct
 
-from . import layer_processor
+from . import handler_services, layer_processor
+from .planner import LayerPlanner
 
 
 class Boto3Layer(Construct):
@@ -17,21 +19,84 @@ class Boto3Layer(Construct):
         layer_name: str,
         boto3_version=None,
         only_services=None,
+        handler_source=None,
+        allow_dynamic: bool = False,
         pickle_data: bool = False,
+        codec: str = None,
+        bundle: bool = False,
+        lazy_shapes: bool = False,
+        latest_api_only: bool = False,
+        drop_models=(),
+        partitions=None,
+        regions=None,
+        shake_workloads=(),
+        runtime_pythons=(),
+        share_data: bool = True,
+        bytecode: bool = False,
+        bytecode_optimize: int = 0,
+        zip_levels=None,
+        model_cache_size: int = 0,
+        client_class_cache: bool = False,
+        endpoint_regions=None,
+        low_memory: bool = False,
         retain_layers: bool = False,
+        use_cache: bool = True,
+        planner: LayerPlanner = None,
         **kwargs,
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
+        if handler_source:
+            # services named in handler code, plus any listed for calls the analysis can't resolve, which
+            # are only accepted with allow_dynamic
+            only_services = handler_services.services_for_handlers(
+                handler_source, extra_services=only_services or (), allow_dynamic=allow_dynamic
+            )
         if only_services:
             only_services = sorted(only_services)
 
-        layer_dir, version_info = layer_processor.build_botocore_zip(construct_id, only_services=only_services, boto3_version=boto3_version)
+        settings = dict(
+            only_services=only_services,
+            boto3_version=boto3_version,
+            pickle_data=pickle_data,
+            codec=codec,
+            bundle=bundle,
+            lazy_shapes=lazy_shapes,
+            latest_api_only=latest_api_only,
+            drop_models=drop_models,
+            partitions=partitions,
+            regions=regions,
+            shake_workloads=shake_workloads,
+            runtime_pythons=runtime_pythons,
+            share_data=share_data,
+            bytecode=bytecode,
+            bytecode_optimize=bytecode_optimize,
+            package=True,
+            zip_levels=zip_levels,
+            model_cache_size=model_cache_size,
+            client_class_cache=client_class_cache,
+            endpoint_regions=endpoint_regions,
+            low_memory=low_memory,
+            use_cache=use_cache,
+        )
+        publish = partial(
+            self._publish,
+            layer_name=layer_name,
+            boto3_version=boto3_version,
+            only_services=only_services,
+            runtime_pythons=runtime_pythons,
+            retain_layers=retain_layers,
+        )
+        if planner is not None:
+            # the layer version is only created when planner.build() runs
+            planner.add(construct_id, callback=publish, **settings)
+        else:
+            publish(*layer_processor.build_layer(construct_id, **settings))
+
+    def _publish(self, layer_dir, version_info, *, layer_name, boto3_version, only_services, runtime_pythons, retain_layers):
         if only_services:
             description = f"Boto3 and botocore stripped to {','.join(only_services)[:100]}. "
         else:
             description = "Boto3 and botocore stripped of docs. "
-        if pickle_data:
-            layer_processor.pickle_service_json(layer_dir)
 
         description += ",".join(f"{k}={version_info[k]}" for k in sorted(version_info))
         # f" {json.dumps(version_info, sort_keys=True)}"
@@ -41,14 +106,12 @@ class Boto3Layer(Construct):
             "Boto3Layer",
             # arn:[a-zA-Z0-9-]+:lambda:[a-zA-Z0-9-]+:\d{12}:layer:[a-zA-Z0-9-_]+)|[a-zA-Z0-9-_]+
             layer_version_name=f"{layer_name}_boto3_{boto3_version or 'latest'}".replace(".", "-"),
+            # a prebuilt zip is uploaded as is, so an unchanged layer keeps its asset hash
             code=Code.from_asset(path=str(layer_dir)),
+            # only the runtimes the layer has a python/lib/pythonX.Y tree for
             compatible_runtimes=[
-                Runtime.PYTHON_3_8,
-                Runtime(
-                    "python3.9",
-                    RuntimeFamily.PYTHON,
-                    supports_inline_code=True,
-                ),
+                Runtime(runtime, RuntimeFamily.PYTHON, supports_inline_code=True)
+                for runtime in sorted({layer_processor.runtime_of(python) for python in runtime_pythons} or {layer_processor.PY_VER})
             ],
             description=description,
             removal_policy=RemovalPolicy.RETAIN if retain_layers else RemovalPolicy.DESTROY,
@@ -1,19 +1,68 @@
 import ast
+import fcntl
+import gzip
+import hashlib
 import json
+import marshal
 import os
 import pickle
+import pprint
+import re
 import shutil
+import statistics
+import struct
 import sys
+import tempfile
+import threading
+import time
 import typing as t
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date
+from functools import partial
 from pathlib import Path
-from subprocess import check_output
+from subprocess import CalledProcessError, check_output
+
+from . import installer, telemetry
+from .accounting import SizeLedger, human_size, ledger_path
+from .benchmark import DEFAULT_WORKLOADS, Workload, probe, runtime_of
+from .installer import CACHE_DIR
 
 PY_VER = f"python{sys.version_info.major}.{sys.version_info.minor}"
+FICLONE = 0x40049409
+# matches the deflate level CDK asset zips are written with
+ZIP_LEVEL = 6
+
+
+@contextmanager
+def _replacing(path: Path, mode: str = "w"):
+    """Write to a sibling file and rename it over `path`
+
+    Snapshots share inodes with the tree they were taken from, so files must never be rewritten in place.
+    """
+    tmp = Path(path).with_name(f".{Path(path).name}.tmp")
+    with open(tmp, mode) as f:
+        yield f
+    os.replace(tmp, path)
 
 
-def _json_files(target):
+def _model_files(target):
+    """JSON model files, including the .json.gz that newer botocore ships service-2 and endpoint-rule-set-1 as"""
     for parent, _, files in os.walk(target):
-        yield from (Path(parent) / j for j in files if j.endswith(".json"))
+        yield from (Path(parent) / j for j in files if j.endswith((".json", ".json.gz")))
+
+
+def _read_model(model_file: Path) -> bytes:
+    with open(model_file, "rb") as f:
+        raw = f.read()
+    return gzip.decompress(raw) if model_file.name.endswith(".gz") else raw
+
+
+def _transformed_path(model_file: Path) -> Path:
+    """Where a transformed model is written: gzipped models become plain .json, which the loader tries first"""
+    return model_file.with_name(model_file.name[: -len(".gz")]) if model_file.name.endswith(".gz") else model_file
 
 
 def _replace_documentation(obj):
@@ -27,30 +76,256 @@ def _replace_documentation(obj):
         return obj
 
 
-def strip_docs(json_file):
-    with open(json_file) as f:
-        raw = json.load(f)
-    fixed = _replace_documentation(raw)
-    with open(json_file, "w") as f:
-        json.dump(fixed, f, separators=(",", ":"))
+def _identity(obj):
+    return obj
+
+
+# Transforms applied to each decoded model in order. Compaction happens when the result is written, so
+# "dedent" needs no work of its own and only exists to mark the point the dedented snapshot is taken.
+JSON_TRANSFORMS: t.Dict[str, t.Callable] = {
+    "dedent": _identity,
+    "strip_docs": _replace_documentation,
+}
+DEFAULT_TRANSFORMS = ("dedent", "strip_docs")
+# names the size report uses for the model data each transform leaves behind
+STAGE_NAMES = {"dedent": "compacted", "strip_docs": "doc-stripped"}
+
+
+def _compact(obj) -> bytes:
+    return json.dumps(obj, sort_keys=True, separators=(",", ":")).encode()
+
+
+def _write_bytes(payload: bytes, path: Path):
+    with _replacing(path, "wb") as f:
+        f.write(payload)
+
+
+def _pickle_dumps(obj) -> bytes:
+    return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+# list values botocore only ever reads, stored as tuples so identical ones can be shared
+SHARED_TUPLE_KEYS = ("enum", "required")
+
+
+def _interned(obj, table: dict):
+    """`obj` with each distinct string, and each distinct SHARED_TUPLE_KEYS tuple, replaced by one instance"""
+    if isinstance(obj, str):
+        return table.setdefault(obj, obj)
+    if isinstance(obj, list):
+        return [_interned(v, table) for v in obj]
+    if isinstance(obj, dict):
+        interned = {}
+        for k, v in obj.items():
+            v = _interned(v, table)
+            if k in SHARED_TUPLE_KEYS and isinstance(v, list):
+                v = table.setdefault(tuple(v), tuple(v))
+            interned[table.setdefault(k, k)] = v
+        return interned
+    return obj
+
+
+def _interned_pickle_dumps(obj) -> bytes:
+    # pickle memoizes by identity, so every repeat of a shared object is written as a back reference and
+    # loads as that same object
+    return _pickle_dumps(_interned(obj, {}))
+
+
+class Codec(t.NamedTuple):
+    """A model serialization format and the FileLoader botocore needs to read it back"""
+
+    name: str
+    suffix: str
+    # stage name in the size report
+    stage: str
+    dumps: t.Callable[[t.Any], bytes]
+    loads: t.Callable[[bytes], t.Any]
+    # import and expression reading `fp` inside the generated FileLoader. JSON keeps botocore's own loader.
+    loader_import: t.Optional[str] = None
+    loader_expression: t.Optional[str] = None
+    # expression decoding a memoryview `data` sliced out of a model bundle
+    buffer_expression: str = "json.loads(bytes(data))"
+
+    @property
+    def loader_class(self) -> str:
+        return f"{self.name.capitalize()}FileLoader"
+
 
+CODECS: t.Dict[str, Codec] = {
+    "json": Codec("json", ".json", "doc-stripped", _compact, json.loads),
+    # pickles are written at the build interpreter's highest protocol, which every supported runtime reads
+    "pickle": Codec("pickle", ".pickle", "pickled", _pickle_dumps, pickle.loads, "import pickle", "pickle.load(fp)", "pickle.loads(data)"),
+    # pickles whose repeated strings and read-only lists are single objects, which load shared
+    "interned": Codec(
+        "interned", ".ipickle", "interned", _interned_pickle_dumps, pickle.loads, "import pickle", "pickle.load(fp)", "pickle.loads(data)"
+    ),
+    # marshal's format can change between Python versions, so these must be built by the target runtime
+    "marshal": Codec(
+        "marshal", ".marshal", "marshalled", marshal.dumps, marshal.loads, "import marshal", "marshal.load(fp)", "marshal.loads(data)"
+    ),
+}
+# the format version each binary codec writes, which the build interpreter decides
+CODEC_FORMATS = {"pickle": pickle.HIGHEST_PROTOCOL, "interned": pickle.HIGHEST_PROTOCOL, "marshal": marshal.version}
 
-def dedent_json(json_file):
-    """Open a whitespaced and readable JSON file and compact to sorted-key JSON"""
-    with open(json_file) as f:
-        raw = json.load(f)
-    with open(json_file, "w") as f:
-        json.dump(raw, f, sort_keys=True, separators=(",", ":"))
 
+# transformed and encoded model files, shared by every build and boto3 version
+STORE_DIR = CACHE_DIR / "models"
+# store entries no build has reused for this many days are deleted
+STORE_TTL_DAYS = 30
 
-def walk_boto3_data(package_dir: Path, actor: t.Callable):
-    for json_file in _json_files(package_dir / "boto3/data"):
-        actor(json_file)
 
+class ModelStore:
+    """Outputs of one chain of transforms, keyed by the sha256 of the model file they were made from
 
-def walk_botocore_data(package_dir: Path, actor: t.Callable):
-    for json_file in _json_files(package_dir / "botocore/data"):
-        actor(json_file)
+    Most model files are identical between boto3 releases, so after a version bump only changed or added
+    files are processed again and every other output is linked out of the store. manifest.json maps each
+    source hash to the sizes recorded for its output and the day a build last used it. Entries unused for
+    STORE_TTL_DAYS are deleted with their output, which is how models dropped from botocore leave the
+    store. The build code is part of the store's name, so editing a transform never reuses stale output.
+    """
+
+    def __init__(self, name: str, root: Path = STORE_DIR):
+        self.root = root / f"{name}-{_code_hash()[:16]}"
+        manifest = self.root / "manifest.json"
+        self.manifest = json.loads(manifest.read_text()) if manifest.exists() else {}
+        self.used: t.Dict[str, t.Dict[str, int]] = {}
+        self.hits = self.misses = 0
+
+    def _object(self, digest: str) -> Path:
+        return self.root / "objects" / digest[:2] / digest
+
+    def fetch(self, digest: str, dest: Path) -> t.Optional[t.Dict[str, int]]:
+        """Link the stored output over `dest` and return its sizes, or None when the store lacks it"""
+        entry = self.manifest.get(digest)
+        if entry is None or not self._object(digest).exists():
+            self.misses += 1
+            return None
+        tmp = dest.with_name(f".{dest.name}.tmp")
+        if tmp.exists():
+            tmp.unlink()
+        _link_file(self._object(digest), tmp)
+        os.replace(tmp, dest)
+        self.used[digest] = entry["sizes"]
+        self.hits += 1
+        return entry["sizes"]
+
+    def put(self, digest: str, output: Path, sizes: t.Dict[str, int]):
+        """Keep `output`, made from the file hashing to `digest`, sharing its data with the tree it is in"""
+        stored = self._object(digest)
+        stored.parent.mkdir(parents=True, exist_ok=True)
+        # one per thread, so builds sharing the store never link through the same name
+        tmp = stored.with_name(f".{digest}.{os.getpid()}.{threading.get_ident()}")
+        if tmp.exists():
+            tmp.unlink()
+        _link_file(output, tmp)
+        os.replace(tmp, stored)
+        self.used[digest] = sizes
+
+    def save(self):
+        """Merge what this build used into manifest.json and expire old entries, locked against other builds"""
+        today = date.today()
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.root / ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            manifest_path = self.root / "manifest.json"
+            manifest = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+            manifest.update({digest: {"sizes": sizes, "used": today.isoformat()} for digest, sizes in self.used.items()})
+            for digest, entry in list(manifest.items()):
+                if (today - date.fromisoformat(entry["used"])).days > STORE_TTL_DAYS:
+                    del manifest[digest]
+                    if self._object(digest).exists():
+                        self._object(digest).unlink()
+            with _replacing(manifest_path) as f:
+                json.dump(manifest, f)
+        self.manifest = manifest
+        print(f"Reused {self.hits} model files from {self.root}, processed {self.misses}")
+
+
+def _file_digest(path: Path) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def transform_json(json_file: Path, package_dir: Path, transforms=DEFAULT_TRANSFORMS, mirrors=None) -> t.Dict[str, int]:
+    """Read a model file once, apply each named transform in order and write compact sorted-key JSON
+
+    `mirrors` maps a transform name to another package dir that receives the intermediate result after
+    that transform, so snapshots of earlier stages don't need a pass of their own. A .json.gz model is
+    written back as plain .json (see _transformed_path). Returns the size of the file after every stage,
+    plus its deflated size as it would ship.
+    """
+    with open(json_file, "rb") as f:
+        raw = f.read()
+    sizes = {"raw": len(raw)}
+    payload = gzip.decompress(raw) if json_file.name.endswith(".gz") else raw
+    data = json.loads(payload)
+    output = _transformed_path(json_file)
+    for name in transforms:
+        data = JSON_TRANSFORMS[name](data)
+        payload = _compact(data)
+        sizes[STAGE_NAMES.get(name, name)] = len(payload)
+        if mirrors and name in mirrors:
+            _write_bytes(payload, mirrors[name] / output.relative_to(package_dir))
+            if output != json_file:
+                os.unlink(mirrors[name] / json_file.relative_to(package_dir))
+    _write_bytes(payload, output)
+    if output != json_file:
+        os.unlink(json_file)
+    sizes["zipped"] = len(zlib.compress(payload, ZIP_LEVEL))
+    return sizes
+
+
+def transform_data(
+    package_dir: Path,
+    transforms=DEFAULT_TRANSFORMS,
+    mirrors=None,
+    workers=None,
+    ledger: SizeLedger = None,
+    file_sizes: dict = None,
+    incremental: bool = True,
+):
+    """Run the transform chain over every boto3 and botocore model file, spread across a process pool
+
+    `file_sizes` collects the per-stage sizes of each file by its path relative to `package_dir`, as
+    written by transform_json. With `incremental`, files a previous build already transformed are linked
+    out of a ModelStore instead; `mirrors` need every intermediate stage, so they always process everything.
+    """
+    files = [*_model_files(package_dir / "botocore/data"), *_model_files(package_dir / "boto3/data")]
+    store = ModelStore("-".join(["transformed", *transforms])) if incremental and not mirrors else None
+    results, pending, digests = {}, [], {}
+    for json_file in files:
+        if store is not None:
+            digests[json_file] = _file_digest(json_file)
+            results[json_file] = store.fetch(digests[json_file], _transformed_path(json_file))
+            if results[json_file] is not None and _transformed_path(json_file) != json_file:
+                os.unlink(json_file)
+        if results.get(json_file) is None:
+            pending.append(json_file)
+    actor = partial(transform_json, package_dir=package_dir, transforms=tuple(transforms), mirrors=mirrors)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # service-2 files dominate the work, so small chunks keep the big ones from piling onto one worker
+        for json_file, sizes in zip(pending, pool.map(actor, pending, chunksize=8)):
+            results[json_file] = sizes
+            if store is not None:
+                store.put(digests[json_file], _transformed_path(json_file), sizes)
+    if store is not None:
+        store.save()
+    final = STAGE_NAMES.get(transforms[-1], transforms[-1]) if transforms else "raw"
+    telemetry.record(
+        files=len(files),
+        bytes_in=sum(sizes["raw"] for sizes in results.values()),
+        bytes_out=sum(sizes[final] for sizes in results.values()),
+        cache_hits=store.hits if store is not None else 0,
+        cache_misses=store.misses if store is not None else len(files),
+    )
+    for json_file in files:
+        relative = _transformed_path(json_file).relative_to(package_dir)
+        if ledger is not None:
+            for stage, nbytes in results[json_file].items():
+                ledger.record(stage, relative, nbytes)
+        if file_sizes is not None:
+            file_sizes[str(relative)] = results[json_file]
+    return len(files)
 
 
 def strip_unused_services(package_dir: Path, only_services):
@@ -79,40 +354,300 @@ def rm_cruft(package_dir: Path):
                 os.unlink(here / f)
 
 
-def size_on_disk(dirname: os.PathLike):
-    return check_output(["du", "-sh", dirname], cwd=Path(".")).decode().strip().split("\t")[0]
+def _is_cruft(name: str) -> bool:
+    return name == "__pycache__" or name.endswith(".pyc") or name.endswith("examples-1.json")
 
 
-def install_boto3(boto3_version) -> Path:
-    package_dir = Path("/tmp") / f"pkg_boto3_{boto3_version}"
-    if package_dir.exists():
-        return package_dir
-
-    package_dir.mkdir(parents=True)
-
-    pip_result = check_output(
-        [
-            ".venv/bin/pip",
-            "install",
-            "-t",
-            str(package_dir),
-            f"boto3=={boto3_version}" if boto3_version else "boto3",
-        ],
-        cwd=Path("."),
-    )
-    print("----")
-    print(pip_result.decode())
-    print("----")
-    return package_dir
+def _latest_api_versions(source: Path) -> t.Dict[str, t.Set[str]]:
+    """The newest API version of each service in botocore/data and in boto3/data
+
+    boto3 creates a resource's client at the newest resources-1 version, so when that is older than the
+    newest botocore version both are kept.
+    """
+    latest = {}
+    for data_dir in (source / "botocore/data", source / "boto3/data"):
+        for service in os.listdir(data_dir):
+            if not (data_dir / service).is_dir():
+                continue
+            versions = [v for v in os.listdir(data_dir / service) if (data_dir / service / v).is_dir()]
+            if versions:
+                latest.setdefault(service, set()).add(max(versions))
+    return latest
+
+
+def _tally(dropped: t.Dict[str, t.List[int]], knob: str, dirname: str, names):
+    counts = dropped.setdefault(knob, [0, 0])
+    for name in names:
+        path = os.path.join(dirname, name)
+        files = [path] if os.path.isfile(path) else [os.path.join(p, f) for p, _, fs in os.walk(path) for f in fs]
+        counts[0] += len(files)
+        counts[1] += sum(os.stat(f).st_size for f in files)
+
+
+def _prune_filter(source: Path, only_services=None, latest_api_only: bool = False, drop_models=(), dropped=None):
+    """copytree ignore callback doing the work of rm_cruft and strip_unused_services during the copy
+
+    `latest_api_only` skips all but the newest API version of each service, and `drop_models` skips model
+    types like paginators-1, waiters-2 or resources-1 along with their sdk-extras. What each knob left out
+    is counted into `dropped`.
+    """
+    data_dirs = {str(source / "botocore/data"), str(source / "boto3/data")}
+    latest = _latest_api_versions(source) if latest_api_only else {}
+    dropped = {} if dropped is None else dropped
+
+    def ignore(dirname, names):
+        ignored = {n for n in names if _is_cruft(n)}
+        if only_services and dirname in data_dirs:
+            ignored.update(n for n in names if n not in only_services and os.path.isdir(os.path.join(dirname, n)))
+        parent = os.path.dirname(dirname)
+        if latest_api_only and parent in data_dirs and os.path.basename(dirname) in latest:
+            old = {n for n in names if n not in latest[os.path.basename(dirname)] and os.path.isdir(os.path.join(dirname, n))}
+            _tally(dropped, "latest_api_only", dirname, old)
+            ignored |= old
+        if drop_models and os.path.dirname(parent) in data_dirs:
+            for type_name in drop_models:
+                unwanted = {n for n in names if n.split(".")[0] == type_name}
+                _tally(dropped, type_name, dirname, unwanted)
+                ignored |= unwanted
+        return ignored
+
+    return ignore
+
+
+def _prune_endpoint_data(data: dict, partitions=None, regions=None, prefixes=None) -> dict:
+    data["partitions"] = [p for p in data["partitions"] if partitions is None or p["partition"] in partitions]
+    for partition in data["partitions"]:
+        if prefixes is not None:
+            partition["services"] = {name: s for name, s in partition["services"].items() if name in prefixes}
+        if regions is None:
+            continue
+        dropped = set(partition["regions"]) - set(regions)
+        kept = set(partition["regions"]) - dropped
+        partition["regions"] = {r: v for r, v in partition["regions"].items() if r not in dropped}
+        for service in partition["services"].values():
+            if "endpoints" in service:
+                service["endpoints"] = {
+                    k: v for k, v in service["endpoints"].items() if not _names_region(k, dropped) or _names_region(k, kept)
+                }
+    return data
 
 
-def _checkpoint(source: Path, dest: Path):
+def _names_region(key: str, region_names) -> bool:
+    """Whether an endpoint key is one of the regions as a whole dash or dot separated part
+
+    That covers pseudo regions like fips-us-east-1, us-east-1-fips or rds.us-east-1, while global endpoints
+    like aws-global and keys merely containing a region's letters stay.
+    """
+    return any(re.search(rf"(?:^|[-.]){re.escape(region)}(?:$|[-.])", key) for region in region_names)
+
+
+def _prune_partition_data(data: dict, partitions=None, regions=None, prefixes=None) -> dict:
+    # regions left out still resolve to their partition through its regionRegex
+    data["partitions"] = [p for p in data["partitions"] if partitions is None or p["id"] in partitions]
+    if regions is not None:
+        for partition in data["partitions"]:
+            partition["regions"] = {r: v for r, v in partition["regions"].items() if r in regions}
+    return data
+
+
+def _endpoint_prefixes(package_dir: Path) -> t.Set[str]:
+    prefixes = set()
+    for p, _, files in os.walk(package_dir / "botocore/data"):
+        for f in files:
+            if _type_name(f) == "service-2":
+                metadata = json.loads(_read_model(Path(p) / f))["metadata"]
+                prefixes.add(metadata.get("endpointPrefix"))
+    return prefixes
+
+
+def prune_endpoints(package_dir: Path, partitions=None, regions=None, only_services=None) -> t.Dict[str, dict]:
+    """Cut endpoints.json and partitions.json down to the partitions and regions a layer is deployed in
+
+    With `only_services`, endpoints.json also drops services whose models the layer doesn't ship. The
+    files are written as compact sorted-key JSON, like transform_data's output. Returns the size and decode
+    time of each file before and after; the times are of decoding that file alone, not of creating a client.
+    """
+    prefixes = _endpoint_prefixes(package_dir) if only_services else None
+    report = {}
+    for name, prune in (("endpoints.json", _prune_endpoint_data), ("partitions.json", _prune_partition_data)):
+        path = package_dir / "botocore" / "data" / name
+        if not path.exists():
+            continue
+        raw = path.read_bytes()
+        payload = _compact(prune(json.loads(raw), partitions, regions, prefixes))
+        _write_bytes(payload, path)
+        report[name] = {
+            "bytes_before": len(raw),
+            "bytes_after": len(payload),
+            "load_seconds_before": _time_loads(CODECS["json"], raw, 3),
+            "load_seconds_after": _time_loads(CODECS["json"], payload, 3),
+        }
+    return report
+
+
+def installed_sizes(source: Path) -> SizeLedger:
+    """Sizes of a pip install, measured once per install and kept next to it"""
+    path = ledger_path(source)
+    if path.exists():
+        return SizeLedger.load(path)
+    ledger = SizeLedger()
+    for parent, _, files in os.walk(source):
+        for f in files:
+            full_path = os.path.join(parent, f)
+            ledger.record("installed", os.path.relpath(full_path, source), os.stat(full_path).st_size)
+    ledger.write(path)
+    return ledger
+
+
+def install_boto3(boto3_version, python_versions=None) -> Path:
+    """boto3 and its dependencies unpacked from the wheelhouse; None is the newest release
+
+    Dependencies are resolved for the X.Y `python_versions` the layer targets, by default the build
+    interpreter's (see target_python_versions).
+    """
+    with telemetry.stage("install", boto3_version=boto3_version) as event:
+        installed = set(installer.INSTALL_ROOT.glob("pkg_boto3_*"))
+        source = installer.install(boto3_version, python_versions=python_versions)
+        if source in installed:
+            event.record(cache_hits=1)
+        else:
+            sizes = [os.path.getsize(os.path.join(p, f)) for p, _, files in os.walk(source) for f in files]
+            event.record(cache_misses=1, files=len(sizes), bytes_out=sum(sizes))
+        return source
+
+
+def target_python_versions(runtime_pythons=()) -> t.Optional[t.List[str]]:
+    """The X.Y versions of the interpreters in `runtime_pythons`, or None for the build interpreter"""
+    return sorted({runtime_of(python)[len("python") :] for python in runtime_pythons}) or None
+
+
+def _reflink(source, dest):
+    with open(source, "rb") as src, open(dest, "xb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def _link_file(source, dest):
+    """Share the source file's data instead of copying it: hardlink, else reflink, else a real copy
+
+    `dest` must not exist yet. A file already there may share its data with another tree, so it is never
+    opened for writing and FileExistsError is raised instead.
+    """
+    try:
+        os.link(source, dest)
+        return dest
+    except FileExistsError:
+        raise
+    except OSError:
+        pass
+    try:
+        _reflink(source, dest)
+        shutil.copystat(source, dest)
+        return dest
+    except FileExistsError:
+        raise
+    except OSError:
+        return shutil.copy2(source, dest)
+
+
+def _checkpoint(source: Path, dest: Path, ignore=None, ledger: SizeLedger = None, stage: str = None, stage_sizes=None):
+    """Snapshot a tree without duplicating file data
+
+    Every stage writes through `_replacing`, so a rewritten file gets a new inode and only that file is
+    materialized again; everything left untouched stays shared with the snapshot. Files listed in
+    `stage_sizes` record those sizes by stage instead of their own size under `stage`.
+    """
     if dest.exists():
         shutil.rmtree(dest)
-    shutil.copytree(source, dest)
+
+    def copy_function(src, dst):
+        if ledger is not None:
+            relative = os.path.relpath(dst, dest)
+            for name, nbytes in (stage_sizes or {}).get(relative, {stage: os.stat(src).st_size}).items():
+                ledger.record(name, relative, nbytes)
+        return _link_file(src, dst)
+
+    shutil.copytree(source, dest, ignore=ignore, copy_function=copy_function)
 
 
-def build_botocore_zip(layer_name, boto3_version=None, only_services=None):
+def _rewrite_file(path: Path, rewriter: t.Callable[[str], str]):
+    with open(path, "r") as f:
+        rewritten = rewriter(f.read())
+    with _replacing(path) as out:
+        out.write(rewritten)
+
+
+# file extensions a model type name can carry in botocore/data and boto3/data
+MODEL_SUFFIXES = (".json.gz", *(codec.suffix for codec in CODECS.values()))
+
+
+def _type_name(filename: str) -> t.Optional[str]:
+    for suffix in MODEL_SUFFIXES:
+        if filename.endswith(suffix):
+            return filename[: -len(suffix)]
+    return None
+
+
+def build_service_index(package_dir: Path) -> t.Dict[str, t.Dict[str, t.Tuple[str, ...]]]:
+    """Map each service in botocore/data and boto3/data to its API versions and the model types of each"""
+    index = {}
+    for data_dir in (package_dir / "botocore/data", package_dir / "boto3/data"):
+        for service in os.listdir(data_dir):
+            if not (data_dir / service).is_dir():
+                continue
+            for api_version in os.listdir(data_dir / service):
+                if not (data_dir / service / api_version).is_dir():
+                    continue
+                types = {_type_name(f) for f in os.listdir(data_dir / service / api_version)} - {None}
+                index.setdefault(service, {}).setdefault(api_version, set()).update(types)
+    return {
+        service: {api_version: tuple(sorted(types)) for api_version, types in sorted(versions.items())}
+        for service, versions in sorted(index.items())
+    }
+
+
+def write_service_index(package_dir: Path):
+    """Generate botocore/_service_index.py, which the index-patched Loader answers listing calls from
+
+    Type names carry no file extension, so one index serves every model encoding.
+    """
+    index = build_service_index(package_dir)
+    with _replacing(package_dir / "botocore" / "_service_index.py") as f:
+        f.write('"""Services, API versions and model types shipped in this layer. Generated at build time."""\n\n')
+        f.write(f"SERVICES = {pprint.pformat(index, width=140)}\n")
+    return index
+
+
+@telemetry.staged("build_botocore_zip")
+def build_botocore_zip(
+    layer_name,
+    boto3_version=None,
+    only_services=None,
+    transforms=DEFAULT_TRANSFORMS,
+    workers=None,
+    snapshots: bool = True,
+    latest_api_only: bool = False,
+    drop_models=(),
+    partitions=None,
+    regions=None,
+    prepared: Path = None,
+    incremental: bool = True,
+    python_versions=None,
+):
+    """Build the stripped layer tree under cdk.out/layers/<layer_name>
+
+    With `snapshots` the -orig, -dedented and -dedented-docless trees benchmark_everything compares are
+    kept alongside it; turn them off when only the final artifact ships.
+
+    `latest_api_only`, `drop_models`, `partitions` and `regions` prune below the service level (see
+    _prune_filter and prune_endpoints). What each of them saved is written to <layer>.pruning.json.
+
+    A `prepared` tree from prepare_source, which already has `transforms` applied, replaces the pip
+    install as the source so the layer is only linked out of it. `incremental` reuses model files
+    transformed by earlier builds, of this or any other boto3 version (see ModelStore). Dependencies are
+    resolved for `python_versions` (see install_boto3).
+    """
+    if prepared is not None and snapshots:
+        raise ValueError("snapshots of the untransformed stages can't be taken from a prepared source")
     layer_root = Path("./cdk.out/layers") / layer_name
     if layer_root.exists():
         shutil.rmtree(layer_root)
@@ -121,68 +656,1254 @@ def build_botocore_zip(layer_name, boto3_version=None, only_services=None):
         shutil.rmtree(layer_root, ignore_errors=True)
     package_dir.parent.mkdir(parents=True)
 
-    source = install_boto3(boto3_version)
-    _checkpoint(source, package_dir)
-    print(f"Saved botocore and boto3. Base size {size_on_disk(layer_root)}")
-    rm_cruft(package_dir)
-    print(f"Removed cache/pyc. Size {size_on_disk(layer_root)}")
+    source = install_boto3(boto3_version, python_versions)
+    ledger = installed_sizes(source)
+    print(f"Installed botocore and boto3. Base size {human_size(ledger.total('installed'))}")
+    dropped, stage_sizes = {}, None
+    if prepared is not None:
+        source = Path(prepared)
+        with open(f"{prepared}.files.json") as f:
+            # transform stages are recorded for the model files copied out, and "pruned" is their size as installed
+            stage_sizes = {relative: {"pruned": sizes["raw"], **sizes} for relative, sizes in json.load(f).items()}
+    ignore = _prune_filter(source, only_services, latest_api_only=latest_api_only, drop_models=drop_models, dropped=dropped)
+    with telemetry.stage("prune", layer=layer_name) as event:
+        _checkpoint(source, package_dir, ignore=ignore, ledger=ledger, stage="pruned", stage_sizes=stage_sizes)
+        event.record(
+            files=sum(c[0] for names in ledger.stages["pruned"].values() for c in names.values()),
+            bytes_in=ledger.total("installed"),
+            bytes_out=ledger.total("pruned"),
+        )
     if only_services:
-        strip_unused_services(package_dir, only_services)
-        print(f"Removed all unused services. Size {size_on_disk(layer_root)}")
-    _checkpoint(layer_root, Path("./cdk.out/layers") / f"{layer_name}-orig")
+        print(f"Saved botocore and boto3 without cache/pyc and unused services. Size {human_size(ledger.layer_size('pruned'))}")
+    else:
+        print(f"Saved botocore and boto3 without cache/pyc. Size {human_size(ledger.layer_size('pruned'))}")
+    pruning = {knob: {"files": files, "bytes": nbytes} for knob, (files, nbytes) in dropped.items()}
+    if partitions is not None or regions is not None:
+        pruning.update(prune_endpoints(package_dir, partitions, regions, only_services))
+        if prepared is not None:
+            # the prepared sizes predate pruning, so account the pruned files as transform_data would have
+            for name in pruning.keys() & {"endpoints.json", "partitions.json"}:
+                relative = os.path.join("botocore", "data", name)
+                for stage, nbytes in transform_json(package_dir / relative, package_dir, transforms).items():
+                    ledger.resize(stage, relative, nbytes - stage_sizes[relative][stage])
+    for knob, result in pruning.items():
+        saved = result["bytes"] if "bytes" in result else result["bytes_before"] - result["bytes_after"]
+        if "load_seconds_before" in result:
+            print(
+                f"Pruning {knob} saved {human_size(saved)}; decoding the file alone takes "
+                f"{1000 * result['load_seconds_before']:.1f}ms -> {1000 * result['load_seconds_after']:.1f}ms"
+            )
+        else:
+            print(f"Pruning {knob} saved {human_size(saved)}")
+    if pruning:
+        with open(layer_root.with_name(f"{layer_name}.pruning.json"), "w") as f:
+            json.dump(pruning, f, indent=2)
+    if snapshots:
+        _checkpoint(layer_root, Path("./cdk.out/layers") / f"{layer_name}-orig")
 
-    with open(package_dir / "botocore" / "loaders.py", "r") as f:
-        rewritten = rewrite_loaders_for_caching(f.read())
-    with open(package_dir / "botocore" / "loaders.py", "w") as out:
-        out.write(rewritten)
+    _rewrite_file(package_dir / "botocore" / "loaders.py", rewrite_loaders_for_caching)
+    write_service_index(package_dir)
+    _rewrite_file(package_dir / "botocore" / "loaders.py", rewrite_loaders_for_index)
+
+    mirrors = {}
+    if snapshots and "dedent" in transforms:
+        dedented_root = Path("./cdk.out/layers") / f"{layer_name}-dedented"
+        _checkpoint(layer_root, dedented_root)
+        mirrors["dedent"] = dedented_root / "python" / "lib" / PY_VER / "site-packages"
+    if prepared is None:
+        with telemetry.stage("transform", layer=layer_name):
+            count = transform_data(
+                package_dir, transforms=transforms, mirrors=mirrors, workers=workers, ledger=ledger, incremental=incremental
+            )
+    else:
+        count = sum(1 for relative in stage_sizes if (package_dir / relative).exists())
+    for name in transforms:
+        print(f"Applied {name} to {count} JSON files. Size {human_size(ledger.layer_size(STAGE_NAMES.get(name, name)))}")
+    if snapshots and "strip_docs" in transforms:
+        _checkpoint(layer_root, Path("./cdk.out/layers") / f"{layer_name}-dedented-docless")
+    ledger.write(ledger_path(layer_root))
+    versions = installed_versions(package_dir)
+    telemetry.record(boto3=versions.get("boto3"), botocore=versions.get("botocore"))
+    return layer_root, versions
 
-    walk_botocore_data(package_dir, dedent_json)
-    walk_boto3_data(package_dir, dedent_json)
-    _checkpoint(layer_root, Path("./cdk.out/layers") / f"{layer_name}-dedented")
-    print(f"Dedented JSON files. Size {size_on_disk(layer_root)}")
-    walk_botocore_data(package_dir, strip_docs)
-    walk_boto3_data(package_dir, strip_docs)
-    _checkpoint(layer_root, Path("./cdk.out/layers") / f"{layer_name}-dedented-docless")
-    print(f"Removed documentation. Size {size_on_disk(layer_root)}")
+
+def installed_versions(package_dir: Path) -> t.Dict[str, str]:
     versions = {}
     for pkg_info in os.listdir(package_dir):
-        if not (package_dir / pkg_info).is_dir():
-            pass
         if not pkg_info.endswith(".dist-info"):
             continue
         with open(package_dir / pkg_info / "METADATA") as f:
             version = [l.strip().split(":")[1].strip() for l in f.readlines() if l.startswith("Version:")][0]
             versions[pkg_info.split("-")[0]] = version
+    return versions
 
-    return layer_root, versions
+
+def _code_hash() -> str:
+    digest = hashlib.sha256()
+    for source in sorted(Path(__file__).parent.glob("*.py")):
+        digest.update(source.read_bytes())
+    return digest.hexdigest()
+
+
+def layer_cache_key(versions: t.Dict[str, str], only_services=None, **settings) -> str:
+    """Key a finished layer on everything that can change its contents, including the build code itself
+
+    The build interpreter is always part of the key: it names the python/lib/pythonX.Y tree and, through
+    CODEC_FORMATS, decides what encoded models it can be loaded by.
+    """
+    material = {
+        "python": PY_VER,
+        "versions": versions,
+        "only_services": sorted(only_services or []),
+        "settings": settings,
+        "code": _code_hash(),
+    }
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode()).hexdigest()
 
 
-def pickle_service_json(layer_root):
-    new_root = Path(str(layer_root) + "-pickles")
-    print("pickling", new_root)
-    _checkpoint(layer_root, new_root)
+def prepare_source(
+    boto3_version=None, only_services=None, transforms=DEFAULT_TRANSFORMS, workers=None, incremental: bool = True, python_versions=None
+) -> Path:
+    """A pip install pruned to `only_services` with `transforms` applied, for build_botocore_zip's `prepared`
+
+    Kept in CACHE_DIR under a key like a layer's, next to <tree>.files.json holding the size of every model
+    file after each stage, so layers linked out of it can still account for their own files.
+    """
+    source = install_boto3(boto3_version, python_versions)
+    installed_sizes(source)
+    key = layer_cache_key(
+        installed_versions(source), only_services, transforms=list(transforms), prepared=True, python_versions=python_versions
+    )
+    prepared = CACHE_DIR / "prepared" / key
+    if prepared.exists():
+        return prepared
+    with telemetry.stage("prepare", boto3_version=boto3_version):
+        print(f"Preparing boto3 {boto3_version or 'latest'} models for {len(only_services) if only_services else 'all'} services")
+        staging = prepared.with_name(f".{key}.{os.getpid()}")
+        _checkpoint(source, staging, ignore=_prune_filter(source, only_services))
+        file_sizes = {}
+        count = transform_data(staging, transforms=transforms, workers=workers, file_sizes=file_sizes, incremental=incremental)
+        # the sizes go first, so the tree only appears once it is complete
+        with open(f"{prepared}.files.json", "w") as f:
+            json.dump(file_sizes, f)
+        try:
+            staging.rename(prepared)
+        except OSError:
+            shutil.rmtree(staging)
+        print(f"Prepared {count} model files in {prepared}")
+        return prepared
+
+
+def _store_cached_layer(layer_root: Path, versions: t.Dict[str, str], entry: Path):
+    # build next to the final entry and rename, so an interrupted store never looks like a hit
+    staging = entry.with_name(f".{entry.name}.{os.getpid()}")
+    _checkpoint(layer_root, staging / "layer")
+    if ledger_path(layer_root).exists():
+        shutil.copy2(ledger_path(layer_root), ledger_path(staging / "layer"))
+    if Path(f"{layer_root}.zip").exists():
+        _link_file(f"{layer_root}.zip", f"{staging / 'layer'}.zip")
+    with open(staging / "versions.json", "w") as f:
+        json.dump(versions, f, sort_keys=True)
+    try:
+        staging.rename(entry)
+    except OSError:
+        # a concurrent build stored the same key first
+        shutil.rmtree(staging)
+
+
+@telemetry.staged("build_layer")
+def build_layer(
+    layer_name,
+    boto3_version=None,
+    only_services=None,
+    pickle_data: bool = False,
+    transforms=DEFAULT_TRANSFORMS,
+    use_cache: bool = True,
+    snapshots: bool = False,
+    codec: t.Optional[str] = None,
+    bundle: bool = False,
+    lazy_shapes: bool = False,
+    latest_api_only: bool = False,
+    drop_models=(),
+    partitions=None,
+    regions=None,
+    shake_workloads=(),
+    runtime_pythons=(),
+    share_data: bool = True,
+    bytecode: bool = False,
+    bytecode_optimize: int = 0,
+    package: bool = False,
+    zip_levels: t.Dict[str, int] = None,
+    prepared: t.Callable[[], Path] = None,
+    model_cache_size: int = 0,
+    client_class_cache: bool = False,
+    endpoint_regions=None,
+    low_memory: bool = False,
+    incremental: bool = True,
+) -> t.Tuple[Path, t.Dict[str, str]]:
+    """Build the finished layer directory, or reuse one from CACHE_DIR built from identical inputs
+
+    `codec` picks the model encoding from CODECS; `pickle_data` is shorthand for the pickle codec.
+    `lazy_shapes` splits large service models so shapes are only decoded when used, and `bundle` packs the
+    encoded models into a single memory-mapped file. The pruning knobs are passed on to build_botocore_zip.
+    `shake_workloads` tree-shakes Python modules those workloads don't import. Each interpreter in
+    `runtime_pythons` gets its own python/lib/pythonX.Y tree, sharing one copy of the botocore data with
+    `share_data`, and `bytecode` precompiles every runtime's tree with its interpreter. With `package` the
+    deterministic zip from package_layer is returned instead of the directory.
+
+    `model_cache_size` above 0 shares up to that many loaded models between all Loaders of a process, and
+    `client_class_cache` shares generated client classes between sessions. With `endpoint_regions`, endpoints
+    of the kept services in those regions are resolved at build time (see precompute_endpoints).
+    `low_memory` stops Loaders holding models once built into a ServiceModel (see reduce_model_memory); for
+    the smallest footprint pair it with codec="interned" and `lazy_shapes`.
+
+    `incremental` transforms and encodes only the model files no earlier build has (see ModelStore); it
+    never changes the result, so it isn't part of the cache key.
+
+    `prepared` is called on a cache miss for a prepare_source tree to link the layer out of; see
+    planner.LayerPlanner, which shares one between layers.
+    """
+    codec = codec or ("pickle" if pickle_data else "json")
+    if low_memory and model_cache_size:
+        raise ValueError("low_memory releases the models model_cache_size keeps; pick one")
+    runtimes = dict(
+        runtimes=sorted(runtime_of(python) for python in runtime_pythons),
+        share_data=share_data and bool(runtime_pythons),
+        bytecode=bytecode,
+        bytecode_optimize=bytecode_optimize,
+    )
+    python_versions = sorted({runtime[len("python") :] for runtime in runtimes["runtimes"]}) or None
+    versions = installed_versions(install_boto3(boto3_version, python_versions))
+    # scripts key on their contents, so editing a workload script invalidates the layer
+    shake = [w._asdict() if isinstance(w, Workload) else hashlib.sha256(Path(w).read_bytes()).hexdigest() for w in shake_workloads]
+    pruning = dict(
+        latest_api_only=latest_api_only,
+        drop_models=sorted(drop_models),
+        partitions=sorted(partitions) if partitions is not None else None,
+        regions=sorted(regions) if regions is not None else None,
+    )
+    key = layer_cache_key(
+        versions,
+        only_services,
+        codec=codec,
+        bundle=bundle,
+        lazy_shapes=lazy_shapes,
+        transforms=list(transforms),
+        shake=shake,
+        **pruning,
+        **runtimes,
+        zip_levels=(ZIP_LEVELS if zip_levels is None else zip_levels) if package else None,
+        model_cache_size=model_cache_size,
+        client_class_cache=client_class_cache,
+        endpoint_regions=sorted(endpoint_regions) if endpoint_regions else None,
+        low_memory=low_memory,
+        codec_format=CODEC_FORMATS.get(codec),
+    )
+    entry = CACHE_DIR / key
+    if use_cache and (entry / "versions.json").exists():
+        print(f"Reusing cached layer {key[:12]} for {layer_name}")
+        telemetry.record(cache_hits=1)
+        with open(entry / "versions.json") as f:
+            return Path(f"{entry / 'layer'}.zip") if package else entry / "layer", json.load(f)
+
+    telemetry.record(cache_misses=int(use_cache))
+    layer_root, versions = build_botocore_zip(
+        layer_name,
+        boto3_version=boto3_version,
+        only_services=only_services,
+        transforms=transforms,
+        snapshots=snapshots,
+        prepared=prepared() if prepared is not None else None,
+        incremental=incremental,
+        python_versions=python_versions,
+        **pruning,
+    )
+    if codec != "json":
+        layer_root = encode_service_models(layer_root, codec, snapshot=snapshots, incremental=incremental, transforms=transforms)
+    if model_cache_size:
+        layer_root = cache_models(layer_root, model_cache_size, snapshot=snapshots)
+    if client_class_cache:
+        layer_root = cache_client_classes(layer_root, snapshot=snapshots)
+    if endpoint_regions:
+        layer_root = precompute_endpoints(layer_root, endpoint_regions, snapshot=snapshots)
+    if low_memory:
+        layer_root = reduce_model_memory(layer_root, snapshot=snapshots)
+    if lazy_shapes:
+        layer_root = split_service_models(layer_root, codec, snapshot=snapshots)
+    if bundle:
+        layer_root = bundle_service_models(layer_root, codec, snapshot=snapshots)
+    if shake_workloads:
+        layer_root = shake_modules(layer_root, shake_workloads, snapshot=snapshots)
+    if runtime_pythons:
+        layer_root = build_runtimes(layer_root, runtime_pythons, codec, share_data=share_data, snapshot=snapshots)
+    if bytecode:
+        layer_root = compile_bytecode(layer_root, runtime_pythons or (sys.executable,), optimize=bytecode_optimize, snapshot=snapshots)
+    if package:
+        package_layer(layer_root, levels=zip_levels)
+    if use_cache:
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        _store_cached_layer(layer_root, versions, entry)
+    return Path(f"{layer_root}.zip") if package else layer_root, versions
+
+
+@telemetry.staged("encode")
+def encode_service_models(
+    layer_root, codec: str = "pickle", snapshot: bool = True, incremental: bool = True, transforms=DEFAULT_TRANSFORMS
+):
+    """Re-encode model files with a codec in a -<codec>s copy of the layer, or in place without `snapshot`
+
+    `transforms` run over every model before it is encoded. They are no-ops on models build_botocore_zip
+    already transformed, but keep docs out of an encoded layer whatever tree it was made from. With
+    `incremental`, files encoded by earlier builds are linked out of a ModelStore for this interpreter,
+    since pickle protocols and marshal's format depend on it.
+    """
+    codec = CODECS[codec]
+    new_root = Path(f"{layer_root}-{codec.name}s") if snapshot else Path(layer_root)
+    print(f"encoding {codec.name} models into", new_root)
+    if snapshot:
+        _checkpoint(layer_root, new_root)
     package_dir = new_root / "python" / "lib" / PY_VER / "site-packages"
-    botocore_data = package_dir / "botocore" / "data"
-    boto3_data = package_dir / "boto3" / "data"
-
-    _to_pickles(botocore_data)
-    _to_pickles(boto3_data)
-    with open(package_dir / "botocore" / "loaders.py", "r") as f:
-        rewritten = rewrite_loaders_for_pickling(f.read())
-    with open(package_dir / "botocore" / "loaders.py", "w") as out:
-        out.write(rewritten)
+
+    ledger = SizeLedger.load(ledger_path(layer_root))
+    ledger.clear("zipped")
+    store = ModelStore("-".join([codec.stage, *transforms, PY_VER])) if incremental else None
+    _encode_models(package_dir / "botocore" / "data", codec, ledger, package_dir, store, transforms)
+    _encode_models(package_dir / "boto3" / "data", codec, ledger, package_dir, store, transforms)
+    if store is not None:
+        store.save()
+        telemetry.record(cache_hits=store.hits, cache_misses=store.misses)
+    _rewrite_file(package_dir / "botocore" / "loaders.py", partial(rewrite_loaders_for_codec, codec=codec.name))
+    print(f"Encoded model data as {codec.name}. Size {human_size(ledger.layer_size(codec.stage))}")
+    ledger.write(ledger_path(new_root))
+    return new_root
 
 
-def _to_pickles(data_dir):
+def pickle_service_json(layer_root, snapshot: bool = True):
+    """Convert model files to pickles in a -pickles copy of the layer, or in place without `snapshot`"""
+    return encode_service_models(layer_root, "pickle", snapshot=snapshot)
+
+
+def _encode_models(
+    data_dir, codec: Codec, ledger: SizeLedger = None, package_dir: Path = None, store: ModelStore = None, transforms=DEFAULT_TRANSFORMS
+):
     for p, _, files in os.walk(data_dir):
         parent = Path(p)
         for f in files:
-            if not f.endswith(".json"):
+            type_name = _type_name(f)
+            if type_name is None or not f.startswith(type_name + ".json"):
                 continue
-            with open(parent / f) as infile:
-                with open(parent / f.replace(".json", ".pickle"), "wb") as outfile:
-                    pickle.dump(json.load(infile), outfile)
+            with open(parent / f, "rb") as infile:
+                raw = infile.read()
+            encoded = parent / (type_name + codec.suffix)
+            digest = hashlib.sha256(raw).hexdigest() if store is not None else None
+            sizes = store.fetch(digest, encoded) if store is not None else None
+            if sizes is None:
+                # newer botocore ships some models, like endpoint-rule-set-1, gzipped
+                data = json.loads(gzip.decompress(raw) if f.endswith(".gz") else raw)
+                for name in transforms:
+                    data = JSON_TRANSFORMS[name](data)
+                payload = codec.dumps(data)
+                with open(encoded, "wb") as outfile:
+                    outfile.write(payload)
+                sizes = {codec.stage: len(payload)}
+                if ledger is not None or store is not None:
+                    sizes["zipped"] = len(zlib.compress(payload, ZIP_LEVEL))
+                if store is not None:
+                    store.put(digest, encoded, sizes)
             os.unlink(parent / f)
+            telemetry.record(files=1, bytes_in=len(raw), bytes_out=sizes[codec.stage], cache_misses=int(store is None))
+            if ledger is not None:
+                for stage, nbytes in sizes.items():
+                    ledger.record(stage, (parent / f).relative_to(package_dir), nbytes)
+
+
+BUNDLE_MAGIC = b"UBUNDLE1"
+BUNDLE_NAME = "_models.bundle"
+# left in boto3/data once its models are bundled, since the Loader skips search paths that don't exist
+BUNDLE_MARKER = "_models.bundled"
+
+
+@telemetry.staged("bundle")
+def bundle_service_models(layer_root, codec: str = "json", snapshot: bool = True):
+    """Pack every model file of a codec into botocore/data/_models.bundle in a -bundled copy of the layer
+
+    The bundle is BUNDLE_MAGIC, the header length as a little-endian u64, a JSON header mapping each model's
+    extensionless path relative to site-packages to [offset, length] past the header, then the payloads in
+    path order so a service's models sit next to each other. Models in other encodings stay as files and are
+    listed with a null entry, so the loader never has to probe the filesystem for a model the layer lacks.
+    boto3/data keeps a BUNDLE_MARKER file, so it still exists however the layer is copied or zipped.
+    """
+    codec = CODECS[codec]
+    new_root = Path(f"{layer_root}-bundled") if snapshot else Path(layer_root)
+    print("bundling models into", new_root)
+    if snapshot:
+        _checkpoint(layer_root, new_root)
+    package_dir = new_root / "python" / "lib" / PY_VER / "site-packages"
+
+    models, on_disk = {}, set()
+    for data_dir in (package_dir / "botocore" / "data", package_dir / "boto3" / "data"):
+        for p, _, files in os.walk(data_dir):
+            for f in files:
+                type_name = _type_name(f)
+                if type_name is None:
+                    continue
+                key = os.path.relpath(os.path.join(p, type_name), package_dir)
+                if f == type_name + codec.suffix:
+                    models[key] = Path(p) / f
+                else:
+                    on_disk.add(key)
+
+    index, offset = dict.fromkeys(on_disk), 0
+    for key in sorted(models):
+        index[key] = [offset, os.stat(models[key]).st_size]
+        offset += index[key][1]
+    header = json.dumps(index, sort_keys=True, separators=(",", ":")).encode()
+
+    ledger = SizeLedger.load(ledger_path(layer_root))
+    ledger.clear("bundled")
+    with _replacing(package_dir / "botocore" / "data" / BUNDLE_NAME, "wb") as bundle:
+        bundle.write(BUNDLE_MAGIC + struct.pack("<Q", len(header)) + header)
+        for key in sorted(models):
+            with open(models[key], "rb") as f:
+                shutil.copyfileobj(f, bundle)
+            os.unlink(models[key])
+            ledger.record("bundled", models[key].relative_to(package_dir), index[key][1])
+    ledger.record("bundled", Path("botocore") / "data" / BUNDLE_NAME, len(BUNDLE_MAGIC) + 8 + len(header))
+    with _replacing(package_dir / "boto3" / "data" / BUNDLE_MARKER) as marker:
+        marker.write(f"Models of this directory are in botocore/data/{BUNDLE_NAME}\n")
+    ledger.record("bundled", Path("boto3") / "data" / BUNDLE_MARKER, os.stat(package_dir / "boto3" / "data" / BUNDLE_MARKER).st_size)
+    _rewrite_file(package_dir / "botocore" / "loaders.py", partial(rewrite_loaders_for_bundle, codec=codec.name))
+    print(f"Bundled {len(models)} models. Size {human_size(ledger.layer_size('bundled'))}")
+    ledger.write(ledger_path(new_root))
+    return new_root
+
+
+_LAYOUT_PROBE = """
+import json, os, resource, sys, time
+sys.path.insert(0, sys.argv[1])
+data_dirs = (os.sep + 'botocore' + os.sep + 'data' + os.sep, os.sep + 'boto3' + os.sep + 'data' + os.sep)
+opens = []
+sys.addaudithook(lambda event, args: opens.append(args[0]) if event == 'open' and any(d in str(args[0]) for d in data_dirs) else None)
+start = time.perf_counter()
+import botocore.session
+session = botocore.session.get_session()
+for service in sys.argv[2:]:
+    session.create_client(service, region_name='us-east-1')
+seconds = time.perf_counter() - start
+print(json.dumps({'seconds': seconds, 'opens': len(opens), 'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+"""
+
+
+def _probe_layout(layer_root, services, repeat: int) -> dict:
+    site_packages = str((Path(layer_root) / "python" / "lib" / PY_VER / "site-packages").resolve())
+    runs = [json.loads(check_output([sys.executable, "-B", "-c", _LAYOUT_PROBE, site_packages, *services])) for _ in range(repeat)]
+    return {
+        "median_seconds": statistics.median(r["seconds"] for r in runs),
+        "median_max_rss_kb": statistics.median(r["max_rss_kb"] for r in runs),
+        "model_opens": runs[0]["opens"],
+    }
+
+
+def _compare_layouts(layouts: t.Dict[str, Path], services, repeat: int, report_path: Path) -> dict:
+    report = {"services": list(services), **{label: _probe_layout(root, services, repeat) for label, root in layouts.items()}}
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    for label in layouts:
+        result = report[label]
+        print(
+            f"{label}: {1000 * result['median_seconds']:.1f}ms, peak RSS {human_size(1024 * result['median_max_rss_kb'])}, "
+            f"{result['model_opens']} model files opened"
+        )
+    return report
+
+
+def compare_bundle_latency(file_root, bundle_root, services=("ec2", "s3", "iam"), repeat: int = 5) -> dict:
+    """Time importing botocore and creating clients in fresh interpreters against a per-file and a bundled layer
+
+    Also counts the model files each layout opens. The report is written to <bundle>.layout.json.
+    """
+    report_path = Path(bundle_root).with_name(f"{Path(bundle_root).name}.layout.json")
+    return _compare_layouts({"per_file": file_root, "bundled": bundle_root}, services, repeat, report_path)
+
+
+def compare_split_models(full_root, split_root, services=("ec2",), repeat: int = 5) -> dict:
+    """Client creation time and peak RSS for whole against split service models, written to <split>.layout.json"""
+    report_path = Path(split_root).with_name(f"{Path(split_root).name}.layout.json")
+    return _compare_layouts({"whole": full_root, "split": split_root}, services, repeat, report_path)
+
+
+SHAPES_MAGIC = b"USHAPES1"
+
+
+def _shape_refs(shape: dict):
+    for ref in (shape.get("member"), shape.get("key"), shape.get("value"), *shape.get("members", {}).values()):
+        if ref:
+            yield ref["shape"]
+
+
+def _chunk_shapes(model: dict, chunk_size: int) -> t.List[t.List[str]]:
+    """Group shape names so the shapes one operation touches land in as few chunks as possible
+
+    Operations are walked in name order and each claims the not yet placed shapes reachable from its input,
+    output and errors. Shapes no operation reaches go at the end.
+    """
+    shapes = model["shapes"]
+    placed, order = set(), []
+    for operation in (model.get("operations") or {}).values():
+        pending = [operation[k]["shape"] for k in ("input", "output") if k in operation]
+        pending.extend(error["shape"] for error in operation.get("errors", []))
+        while pending:
+            name = pending.pop()
+            if name in placed or name not in shapes:
+                continue
+            placed.add(name)
+            order.append(name)
+            pending.extend(_shape_refs(shapes[name]))
+    order.extend(sorted(set(shapes) - placed))
+    return [order[i : i + chunk_size] for i in range(0, len(order), chunk_size)]
+
+
+def split_service_model(model_file: Path, codec: Codec, chunk_size: int = 50) -> t.Tuple[int, int]:
+    """Move the shapes of a service-2 model into chunks in a sibling <model>.shapes file
+
+    The model keeps everything else plus a shapeChunks map from shape name to chunk number. The shapes
+    file is SHAPES_MAGIC, the header length as a little-endian u64, a JSON header of [offset, length] per
+    chunk past the header, then each chunk encoded with the codec. Returns the size of both files.
+    """
+    with open(model_file, "rb") as f:
+        model = codec.loads(f.read())
+    chunks = _chunk_shapes(model, chunk_size)
+    payloads = [codec.dumps({name: model["shapes"][name] for name in chunk}) for chunk in chunks]
+    assert {name: shape for p in payloads for name, shape in codec.loads(p).items()} == model["shapes"]
+
+    spans, offset = [], 0
+    for payload in payloads:
+        spans.append([offset, len(payload)])
+        offset += len(payload)
+    header = json.dumps(spans, separators=(",", ":")).encode()
+    shapes_file = model_file.with_name(model_file.name[: -len(codec.suffix)] + ".shapes")
+    with _replacing(shapes_file, "wb") as f:
+        f.write(SHAPES_MAGIC + struct.pack("<Q", len(header)) + header)
+        for payload in payloads:
+            f.write(payload)
+
+    del model["shapes"]
+    model["shapeChunks"] = {name: idx for idx, chunk in enumerate(chunks) for name in chunk}
+    core = codec.dumps(model)
+    _write_bytes(core, model_file)
+    return len(core), len(SHAPES_MAGIC) + 8 + len(header) + offset
+
+
+@telemetry.staged("split")
+def split_service_models(layer_root, codec: str = "json", snapshot: bool = True, min_bytes: int = 128 * 1024):
+    """Split service-2 models of at least `min_bytes` into a core and lazily loaded shape chunks
+
+    Works on a -split copy of the layer, or in place without `snapshot`. Must run before bundling, which
+    leaves the .shapes files on disk.
+    """
+    codec = CODECS[codec]
+    new_root = Path(f"{layer_root}-split") if snapshot else Path(layer_root)
+    print("splitting large models in", new_root)
+    if snapshot:
+        _checkpoint(layer_root, new_root)
+    package_dir = new_root / "python" / "lib" / PY_VER / "site-packages"
+
+    ledger = SizeLedger.load(ledger_path(layer_root))
+    ledger.clear("split")
+    count = 0
+    for p, _, files in os.walk(package_dir / "botocore" / "data"):
+        if "service-2" + codec.suffix not in files:
+            continue
+        model_file = Path(p) / ("service-2" + codec.suffix)
+        if os.stat(model_file).st_size < min_bytes:
+            continue
+        core_size, shapes_size = split_service_model(model_file, codec)
+        ledger.record("split", model_file.relative_to(package_dir), core_size)
+        ledger.record("split", model_file.relative_to(package_dir).with_suffix(".shapes"), shapes_size)
+        count += 1
+    _rewrite_file(package_dir / "botocore" / "loaders.py", partial(rewrite_loaders_for_split, codec=codec.name))
+    print(f"Split {count} service models. Core models and shape chunks {human_size(ledger.total('split'))}")
+    ledger.write(ledger_path(new_root))
+    return new_root
+
+
+def _time_loads(codec: Codec, payload: bytes, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        codec.loads(payload)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def measure_codecs(layer_root, codecs=tuple(CODECS), repeat: int = 3) -> dict:
+    """Encode every JSON model in a built layer with each codec and time decoding it
+
+    Timings are the best of `repeat` in-memory decodes on the interpreter running this, so run it under each
+    target runtime to compare them. The report is written to <layer>.codecs.<runtime>.json.
+    """
+    package_dir = Path(layer_root) / "python" / "lib" / PY_VER / "site-packages"
+    models = {}
+    totals = {name: {"bytes": 0, "load_seconds": 0.0} for name in codecs}
+    for json_file in sorted([*_model_files(package_dir / "botocore/data"), *_model_files(package_dir / "boto3/data")]):
+        data = json.loads(_read_model(json_file))
+        results = models[str(json_file.relative_to(package_dir))] = {}
+        for name in codecs:
+            payload = CODECS[name].dumps(data)
+            results[name] = {"bytes": len(payload), "load_seconds": _time_loads(CODECS[name], payload, repeat)}
+            totals[name]["bytes"] += results[name]["bytes"]
+            totals[name]["load_seconds"] += results[name]["load_seconds"]
+    report = {
+        "runtime": PY_VER,
+        "fastest": min(totals, key=lambda name: totals[name]["load_seconds"]),
+        "smallest": min(totals, key=lambda name: totals[name]["bytes"]),
+        "totals": totals,
+        "models": models,
+    }
+    with open(Path(layer_root).with_name(f"{Path(layer_root).name}.codecs.{PY_VER}.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    for name in codecs:
+        print(f"{name}: {human_size(totals[name]['bytes'])}, {1000 * totals[name]['load_seconds']:.1f}ms to load every model")
+    return report
+
+
+# Loads one model payload in a fresh interpreter: the RSS growth of holding it (Linux only, read from
+# /proc/self/statm as startup leaves peak RSS above it), the bytes the loaded model keeps allocated, and the
+# best of `repeat` load times
+_INTERNING_PROBE = """
+import json, os, pickle, sys, time, tracemalloc
+config = json.loads(sys.argv[1])
+def rss_kb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+with open(config['file'], 'rb') as f:
+    payload = f.read()
+before = rss_kb()
+model = pickle.loads(payload)
+rss_kb = rss_kb() - before
+del model
+tracemalloc.start()
+model = pickle.loads(payload)
+retained = tracemalloc.get_traced_memory()[0]
+tracemalloc.stop()
+del model
+best = float('inf')
+for _ in range(config['repeat']):
+    start = time.perf_counter()
+    pickle.loads(payload)
+    best = min(best, time.perf_counter() - start)
+print(json.dumps({'load_seconds': best, 'retained_bytes': retained, 'rss_kb': rss_kb}))
+"""
+
+
+def measure_interning(layer_root, services=("ec2", "s3", "iam"), repeat: int = 5) -> dict:
+    """Compare the interned codec with plain pickle on each service's service-2 model in a JSON layer
+
+    Every encoding is loaded in its own fresh interpreter. The report is written to <layer>.interning.json.
+    """
+    package_dir = Path(layer_root) / "python" / "lib" / PY_VER / "site-packages"
+    report = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for service in services:
+            model_file = max((package_dir / "botocore" / "data" / service).glob("*/service-2.json"))
+            with open(model_file, "rb") as f:
+                data = json.load(f)
+            report[service] = {}
+            for name in ("pickle", "interned"):
+                payload_file = Path(tmp) / f"{service}{CODECS[name].suffix}"
+                payload_file.write_bytes(CODECS[name].dumps(data))
+                config = {"file": str(payload_file), "repeat": repeat}
+                result = json.loads(check_output([sys.executable, "-I", "-S", "-c", _INTERNING_PROBE, json.dumps(config)]))
+                report[service][name] = {"bytes": payload_file.stat().st_size, **result}
+            plain, interned = report[service]["pickle"], report[service]["interned"]
+            print(
+                f"{service}: {human_size(plain['bytes'])} -> {human_size(interned['bytes'])}, "
+                f"{1000 * plain['load_seconds']:.2f}ms -> {1000 * interned['load_seconds']:.2f}ms to load, "
+                f"{human_size(plain['retained_bytes'])} -> {human_size(interned['retained_bytes'])} allocated, "
+                f"{human_size(1024 * plain['rss_kb'])} -> {human_size(1024 * interned['rss_kb'])} RSS growth"
+            )
+    with open(Path(layer_root).with_name(f"{Path(layer_root).name}.interning.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+# Runs a workload and reports the counters of a process-wide cache the layer was rewritten with
+_CACHE_INFO_PROBE = """
+import importlib, json, sys
+config = json.loads(sys.argv[1])
+sys.path.insert(0, config['path'])
+import boto3
+for _ in range(config['sessions']):
+    session = boto3.Session(region_name='us-west-2')
+    for service in config['services']:
+        session.client(service)
+module, function = config['info'].split(':')
+print(json.dumps(getattr(importlib.import_module(module), function)()))
+"""
+
+
+def _cache_info(package_dir: Path, workload: Workload, info: str) -> dict:
+    config = {"path": str(package_dir.resolve()), "services": list(workload.services), "sessions": workload.sessions, "info": info}
+    result = json.loads(check_output([sys.executable, "-I", "-S", "-B", "-c", _CACHE_INFO_PROBE, json.dumps(config)]))
+    print(
+        f"{info} for {workload.sessions}x{','.join(workload.services)}: "
+        f"{result['hits']} hits, {result['misses']} misses, {result['evictions']} evictions"
+    )
+    return result
+
+
+@telemetry.staged("model_cache")
+def cache_models(layer_root, maxsize: int = 64, snapshot: bool = True, workload: Workload = DEFAULT_WORKLOADS["perf-dummy"]):
+    """Share loaded models between every Loader in a process, in a -model-cached copy or in place without `snapshot`
+
+    Each boto3 Session builds a new Loader with an empty cache, so a process making clients from many
+    sessions reads and decodes the same models once per session. The cache counters after running
+    `workload` against the result are printed.
+    """
+    new_root = Path(f"{layer_root}-model-cached") if snapshot else Path(layer_root)
+    print("caching models process-wide in", new_root)
+    if snapshot:
+        _checkpoint(layer_root, new_root)
+    package_dir = new_root / "python" / "lib" / PY_VER / "site-packages"
+    _rewrite_file(package_dir / "botocore" / "loaders.py", partial(rewrite_loaders_for_model_cache, maxsize=maxsize))
+    if snapshot and ledger_path(layer_root).exists():
+        shutil.copy2(ledger_path(layer_root), ledger_path(new_root))
+    _cache_info(package_dir, workload, "botocore.loaders:model_cache_info")
+    return new_root
+
+
+@telemetry.staged("class_cache")
+def cache_client_classes(layer_root, maxsize: int = 128, snapshot: bool = True, workload: Workload = DEFAULT_WORKLOADS["perf-dummy"]):
+    """Reuse generated client classes across sessions, in a -class-cached copy or in place without `snapshot`
+
+    See rewrite_client_for_class_cache. The cache counters after running `workload` are printed.
+    """
+    new_root = Path(f"{layer_root}-class-cached") if snapshot else Path(layer_root)
+    print("caching client classes in", new_root)
+    if snapshot:
+        _checkpoint(layer_root, new_root)
+    package_dir = new_root / "python" / "lib" / PY_VER / "site-packages"
+    _rewrite_file(package_dir / "botocore" / "client.py", partial(rewrite_client_for_class_cache, maxsize=maxsize))
+    if snapshot and ledger_path(layer_root).exists():
+        shutil.copy2(ledger_path(layer_root), ledger_path(new_root))
+    _cache_info(package_dir, workload, "botocore.client:client_class_cache_info")
+    return new_root
+
+
+# Records the endpoints.json lookups creating the clients makes, and resolves the endpoint ruleset parameters
+# of every operation of each client with its provider
+_ENDPOINT_PROBE = """
+import json, sys
+config = json.loads(sys.argv[1])
+sys.path.insert(0, config['path'])
+import botocore.regions, botocore.session
+from botocore.exceptions import EndpointProviderError
+from jmespath.exceptions import JMESPathError
+legacy = {}
+resolver_class = botocore.regions.EndpointResolver
+construct_endpoint, get_available_endpoints = resolver_class.construct_endpoint, resolver_class.get_available_endpoints
+def recording_construct(self, service_name, region_name=None, partition_name=None, use_dualstack_endpoint=False, use_fips_endpoint=False):
+    result = construct_endpoint(self, service_name, region_name, partition_name, use_dualstack_endpoint, use_fips_endpoint)
+    key = ('construct_endpoint', service_name, region_name, partition_name, bool(use_dualstack_endpoint), bool(use_fips_endpoint))
+    legacy[json.dumps(key)] = result
+    return result
+def recording_available(self, service_name, partition_name='aws', allow_non_regional=False, endpoint_variant_tags=None):
+    result = get_available_endpoints(self, service_name, partition_name, allow_non_regional, endpoint_variant_tags)
+    if not endpoint_variant_tags:
+        legacy[json.dumps(('get_available_endpoints', service_name, partition_name, bool(allow_non_regional)))] = result
+    return result
+resolver_class.construct_endpoint, resolver_class.get_available_endpoints = recording_construct, recording_available
+session = botocore.session.get_session()
+loader = session.get_component('data_loader')
+rulesets, resolved = {}, {}
+for service in config['services']:
+    for region in config['regions']:
+        client = session.create_client(service, region_name=region, aws_access_key_id='build', aws_secret_access_key='build')
+        resolver = client._ruleset_resolver
+        if resolver is None:
+            continue
+        ruleset = loader.load_service_model(service, 'endpoint-rule-set-1')
+        rulesets[service] = {'version': ruleset['version'], 'parameters': ruleset['parameters']}
+        for operation in client.meta.service_model.operation_names:
+            try:
+                params = resolver._get_provider_params(client.meta.service_model.operation_model(operation), {}, {})
+            except JMESPathError:
+                # operationContextParams are searched for in the call arguments, which there are none of here
+                continue
+            key = json.dumps([service, sorted(params.items())])
+            if key in resolved:
+                continue
+            try:
+                endpoint = resolver._provider.resolve_endpoint(**params)
+            except EndpointProviderError:
+                continue
+            resolved[key] = [endpoint.url, endpoint.properties, endpoint.headers]
+print(json.dumps({'legacy': legacy, 'rulesets': rulesets, 'resolved': resolved}))
+"""
+
+
+def _kept_services(package_dir: Path) -> t.List[str]:
+    return [s for s, versions in build_service_index(package_dir).items() if any("service-2" in types for types in versions.values())]
+
+
+def _to_tuples(value):
+    return tuple(_to_tuples(v) for v in value) if isinstance(value, list) else value
+
+
+def write_endpoint_table(package_dir: Path, regions) -> t.Dict[str, int]:
+    """Generate botocore/_endpoint_table.py with the endpoints clients of the kept services resolve in `regions`
+
+    LEGACY holds the endpoints.json lookups client creation makes, keyed by method name and arguments.
+    RULESETS holds each service's endpoint ruleset version and parameters, and RULESET_ENDPOINTS what the
+    ruleset resolves for every parameter set the service's operations produce without call arguments.
+    """
+    config = {"path": str(package_dir.resolve()), "services": _kept_services(package_dir), "regions": sorted(regions)}
+    found = json.loads(check_output([sys.executable, "-I", "-S", "-B", "-c", _ENDPOINT_PROBE, json.dumps(config)]))
+    legacy = {tuple(json.loads(key)): result for key, result in found["legacy"].items()}
+    resolved = {_to_tuples(json.loads(key)): tuple(endpoint) for key, endpoint in found["resolved"].items()}
+    with _replacing(package_dir / "botocore" / "_endpoint_table.py") as f:
+        f.write('"""Endpoints resolved for the services and regions of this layer. Generated at build time."""\n\n')
+        f.write(f"REGIONS = {tuple(config['regions'])!r}\n")
+        f.write(f"LEGACY = {pprint.pformat(legacy, width=140)}\n")
+        f.write(f"RULESETS = {pprint.pformat(found['rulesets'], width=140)}\n")
+        f.write(f"RULESET_ENDPOINTS = {pprint.pformat(resolved, width=140)}\n")
+    return {"legacy": len(legacy), "rulesets": len(found["rulesets"]), "ruleset_endpoints": len(resolved)}
+
+
+@telemetry.staged("endpoints")
+def precompute_endpoints(layer_root, regions, snapshot: bool = True):
+    """Resolve endpoints for the kept services in `regions` at build time, in an -endpoints copy or in place
+
+    Creating the first client of every session loads and decodes endpoints.json, and each client builds an
+    EndpointProvider from its service's endpoint ruleset, which the first request then evaluates. With the
+    table from write_endpoint_table, sessions only load endpoints.json and clients only load their ruleset
+    when asked for something the table lacks, like a region not in `regions` or parameters from call
+    arguments such as an S3 bucket. Like the service index, the table is ignored when a data path outside
+    the layer exists.
+    """
+    new_root = Path(f"{layer_root}-endpoints") if snapshot else Path(layer_root)
+    print("precomputing endpoints for", ", ".join(sorted(regions)), "in", new_root)
+    if snapshot:
+        _checkpoint(layer_root, new_root)
+    package_dir = new_root / "python" / "lib" / PY_VER / "site-packages"
+    counts = write_endpoint_table(package_dir, regions)
+    print(f"{counts['legacy']} endpoints.json lookups, {counts['ruleset_endpoints']} ruleset endpoints for {counts['rulesets']} services")
+    _rewrite_file(package_dir / "botocore" / "regions.py", rewrite_regions_for_endpoint_table)
+    _rewrite_file(package_dir / "botocore" / "client.py", rewrite_client_for_endpoint_table)
+    _rewrite_file(package_dir / "botocore" / "session.py", rewrite_session_for_endpoint_table)
+    if snapshot and ledger_path(layer_root).exists():
+        shutil.copy2(ledger_path(layer_root), ledger_path(new_root))
+    return new_root
+
+
+@telemetry.staged("low_memory")
+def reduce_model_memory(layer_root, document_cache_size: int = 2, snapshot: bool = True):
+    """Stop Loaders holding models nothing else uses, in a -low-memory copy or in place without `snapshot`
+
+    See rewrite_loaders_for_low_memory. A client keeps its ServiceModel, and with it the service model,
+    for as long as it lives, so this pays off in processes that outlive their clients, like handlers calling
+    boto3.client() on every invocation. Those decode a model again for every client instead.
+    """
+    new_root = Path(f"{layer_root}-low-memory") if snapshot else Path(layer_root)
+    print("releasing loaded models in", new_root)
+    if snapshot:
+        _checkpoint(layer_root, new_root)
+    package_dir = new_root / "python" / "lib" / PY_VER / "site-packages"
+    _rewrite_file(package_dir / "botocore" / "loaders.py", partial(rewrite_loaders_for_low_memory, document_cache_size=document_cache_size))
+    _rewrite_file(package_dir / "botocore" / "client.py", rewrite_client_for_low_memory)
+    _rewrite_file(package_dir / "botocore" / "session.py", rewrite_session_for_low_memory)
+    if snapshot and ledger_path(layer_root).exists():
+        shutil.copy2(ledger_path(layer_root), ledger_path(new_root))
+    return new_root
+
+
+# Modules kept whatever a workload imports, because code paths that client creation doesn't reach load
+# them lazily: retry modes picked by config, credential providers, request signing, timezone parsing.
+SHAKE_KEEP = (
+    "botocore.retries",
+    "botocore.credentials",
+    "botocore.tokens",
+    "botocore.auth",
+    "botocore.crt",
+    "dateutil.tz",
+    "dateutil.zoneinfo",
+    "urllib3",
+)
+# boto3 customizations loaded on first use of a service's resources or transfer methods, kept whenever
+# the layer ships that service
+SERVICE_MODULES = {"boto3.s3": "s3", "s3transfer": "s3", "boto3.dynamodb": "dynamodb", "boto3.ec2": "ec2"}
+
+_TRACE_PROBE = """
+import json, os, runpy, sys
+config = json.loads(sys.argv[1])
+root = config['path']
+sys.path.insert(0, root)
+if config.get('script'):
+    sys.argv = [config['script'], root]
+    runpy.run_path(config['script'], run_name='__main__')
+else:
+    import boto3
+    from botocore import xform_name
+    from botocore.awsrequest import AWSResponse
+    class EmptyBody:
+        def stream(self, **kwargs):
+            return iter([b''])
+    def respond(request, **kwargs):
+        return AWSResponse(request.url, 200, {}, EmptyBody())
+    for _ in range(config['sessions']):
+        session = boto3.Session(region_name='us-west-2', aws_access_key_id='shake', aws_secret_access_key='shake')
+        for service in config['services']:
+            client = session.client(service)
+            # the request path too: resolving the endpoint, serializing, signing and parsing an empty reply
+            # for an operation without required parameters, and loading a paginator
+            client.meta.events.register('before-send', respond)
+            model = client.meta.service_model
+            methods = {xform_name(name): model.operation_model(name) for name in model.operation_names}
+            method = next((m for m, op in methods.items() if op.input_shape is None or not op.input_shape.required_members), None)
+            if method is not None:
+                try:
+                    getattr(client, method)()
+                except ImportError:
+                    raise
+                except Exception:
+                    pass
+            paginated = next((m for m in methods if client.can_paginate(m)), None)
+            if paginated is not None:
+                client.get_paginator(paginated)
+        for service in config['resources']:
+            session.resource(service)
+modules = [getattr(m, '__file__', None) for m in list(sys.modules.values())]
+print(json.dumps(sorted(os.path.relpath(f, root) for f in modules if f and os.path.abspath(f).startswith(root + os.sep))))
+"""
+
+
+def _module_name(relative_path: str) -> str:
+    name = relative_path[: -len(".py")].replace(os.sep, ".")
+    return name[: -len(".__init__")] if name.endswith(".__init__") else name
+
+
+def trace_imports(package_dir: Path, workloads=(), python: str = sys.executable) -> t.Set[str]:
+    """Python files under `package_dir` imported by any of the workloads
+
+    A workload is a benchmark.Workload, whose clients also send one request answered locally and load a
+    paginator, and whose services get a resource when boto3 has a model for one; or the path of a script
+    that's run with the layer's site-packages as sys.argv[1], like perf_dummy.py.
+    """
+    package_dir = Path(package_dir).resolve()
+    imported = set()
+    for workload in workloads:
+        if isinstance(workload, Workload):
+            resources = [s for s in workload.services if (package_dir / "boto3" / "data" / s).is_dir()]
+            config = {"services": list(workload.services), "sessions": workload.sessions, "resources": resources}
+        else:
+            config = {"script": str(Path(workload).resolve())}
+        output = check_output([python, "-I", "-S", "-B", "-c", _TRACE_PROBE, json.dumps({"path": str(package_dir), **config})])
+        imported.update(json.loads(output.decode().splitlines()[-1]))
+    return imported
+
+
+def _import_seconds(package_dir: Path, runs: int = 5) -> float:
+    return statistics.median(probe(sys.executable, package_dir.resolve(), DEFAULT_WORKLOADS["sts"])["import_seconds"] for _ in range(runs))
+
+
+@telemetry.staged("shake")
+def shake_modules(layer_root, workloads=(DEFAULT_WORKLOADS["perf-dummy"],), keep=SHAKE_KEEP, stub: bool = True, snapshot: bool = True):
+    """Drop or stub the Python modules no workload imports, in a -shaken copy or in place without `snapshot`
+
+    Package __init__ files, SHAKE_KEEP and the SERVICE_MODULES of shipped services always stay. A stub
+    raises ImportError naming the module, so a missed import fails loudly instead of as a bare
+    ModuleNotFoundError. The workloads, request path included (see trace_imports), are re-run against the
+    result to validate it, and the bytes and boto3 import time saved go to <layer>.shaken.json.
+    """
+    new_root = Path(f"{layer_root}-shaken") if snapshot else Path(layer_root)
+    print("tree shaking", new_root)
+    if snapshot:
+        _checkpoint(layer_root, new_root)
+    package_dir = new_root / "python" / "lib" / PY_VER / "site-packages"
+    import_before = _import_seconds(package_dir)
+
+    imported = trace_imports(package_dir, workloads)
+    shipped = {service for module, service in SERVICE_MODULES.items() if (package_dir / "botocore" / "data" / service).is_dir()}
+    keep = (*keep, *(module for module, service in SERVICE_MODULES.items() if service in shipped))
+    data_dirs = (os.path.join("botocore", "data"), os.path.join("boto3", "data"))
+    removed, saved = [], 0
+    for p, _, files in os.walk(package_dir):
+        relative_dir = os.path.relpath(p, package_dir)
+        if relative_dir.startswith(data_dirs) or ".dist-info" in relative_dir:
+            continue
+        for f in files:
+            relative = os.path.normpath(os.path.join(relative_dir, f))
+            module = _module_name(relative) if f.endswith(".py") else None
+            if module is None or f == "__init__.py" or relative in imported:
+                continue
+            if any(module == k or module.startswith(k + ".") for k in keep):
+                continue
+            saved += os.stat(os.path.join(p, f)).st_size
+            if stub:
+                with _replacing(Path(p) / f) as out:
+                    out.write(f"raise ImportError({module + ' was removed from this layer by tree shaking'!r}, name=__name__)\n")
+                saved -= os.stat(os.path.join(p, f)).st_size
+            else:
+                os.unlink(os.path.join(p, f))
+            # precompiled bytecode would still load the original module
+            for pyc in Path(p).glob(f"__pycache__/{f[: -len('.py')]}.*.pyc"):
+                saved += pyc.stat().st_size
+                pyc.unlink()
+            removed.append(module)
+
+    try:
+        still_imported = trace_imports(package_dir, workloads)
+    except CalledProcessError as e:
+        raise RuntimeError("a workload fails against the tree-shaken layer") from e
+    if still_imported - imported:
+        raise RuntimeError(f"tree shaking changed what the workloads import: {sorted(still_imported - imported)}")
+    import_after = _import_seconds(package_dir)
+    report = {
+        "removed": sorted(removed),
+        "bytes_saved": saved,
+        "import_seconds_before": import_before,
+        "import_seconds_after": import_after,
+    }
+    with open(new_root.with_name(f"{new_root.name}.shaken.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    print(
+        f"Removed {len(removed)} unused modules, saving {human_size(saved)}. "
+        f"boto3 import {1000 * import_before:.1f}ms -> {1000 * import_after:.1f}ms"
+    )
+    return new_root
+
+
+def _compile_tree(python: str, target: Path, optimize: int) -> t.Dict[str, int]:
+    optimize_flags = ["-" + "O" * optimize] if optimize else []
+    check_output([python, *optimize_flags, "-m", "compileall", "-q", "-j", "0", "--invalidation-mode", "unchecked-hash", str(target)])
+    sizes = {}
+    for p, _, files in os.walk(target):
+        if os.path.basename(p) == "__pycache__":
+            for f in files:
+                sizes[os.path.relpath(os.path.join(p, f), target)] = os.stat(os.path.join(p, f)).st_size
+    return sizes
+
+
+@telemetry.staged("bytecode")
+def compile_bytecode(layer_root, pythons=(sys.executable,), optimize: int = 0, snapshot: bool = True):
+    """Precompile the layer into unchecked-hash pyc files in a -compiled copy, or in place without `snapshot`
+
+    A layer's filesystem is read-only, so without shipped bytecode every cold start compiles boto3 and
+    botocore from source. Unchecked-hash pycs are loaded without checking the source at all. Each
+    interpreter compiles its own python/lib/pythonX.Y/site-packages, snapshotted from this build's tree
+    when missing, and the interpreters run in parallel. Bytecode at an `optimize` level above 0 is only used
+    by functions that set PYTHONOPTIMIZE. Run this last: any later rewrite of a module would leave its
+    unchecked pyc stale.
+    """
+    new_root = Path(f"{layer_root}-compiled") if snapshot else Path(layer_root)
+    print("compiling bytecode in", new_root)
+    if snapshot:
+        _checkpoint(layer_root, new_root)
+
+    targets = {}
+    for python in pythons:
+        runtime = runtime_of(python)
+        targets[runtime] = (python, new_root / "python" / "lib" / runtime / "site-packages")
+        if not targets[runtime][1].exists():
+            _checkpoint(new_root / "python" / "lib" / PY_VER / "site-packages", targets[runtime][1])
+    ledger = SizeLedger.load(ledger_path(layer_root))
+    with ThreadPoolExecutor(max(1, len(targets))) as pool:
+        compiled = {runtime: pool.submit(_compile_tree, python, target, optimize) for runtime, (python, target) in targets.items()}
+    for runtime, sizes in compiled.items():
+        ledger.clear(f"compiled:{runtime}")
+        for relative, size in sizes.result().items():
+            ledger.record(f"compiled:{runtime}", relative, size)
+        print(f"Compiled bytecode for {runtime}. Size {human_size(ledger.total(f'compiled:{runtime}'))}")
+    ledger.write(ledger_path(new_root))
+    return new_root
+
+
+# botocore/data moves here, next to the lib directory, so every python/lib/pythonX.Y tree loads the same files
+SHARED_DATA_DIR = "botocore-data"
+
+_RUNTIME_FACTS = """
+import json, marshal, pickle, sys
+facts = {'runtime': 'python%d.%d' % sys.version_info[:2], 'pickle_protocol': pickle.HIGHEST_PROTOCOL, 'marshal_version': marshal.version}
+print(json.dumps(facts))
+"""
+
+
+def _runtime_facts(python: str) -> dict:
+    return json.loads(check_output([python, "-I", "-S", "-c", _RUNTIME_FACTS]))
+
+
+def _check_codec(codec: Codec, facts: dict):
+    if codec.loads is pickle.loads and facts["pickle_protocol"] < pickle.HIGHEST_PROTOCOL:
+        raise ValueError(f"{facts['runtime']} can't read pickle protocol {pickle.HIGHEST_PROTOCOL}; build with an older interpreter")
+    if codec.name == "marshal" and facts["runtime"] != PY_VER:
+        raise ValueError(f"marshal models built by {PY_VER} may not load on {facts['runtime']}; build marshal layers per runtime")
+
+
+@telemetry.staged("runtimes")
+def build_runtimes(layer_root, pythons, codec: str = "json", share_data: bool = True, snapshot: bool = True):
+    """Lay the layer out for every runtime in `pythons`, in a -multi copy or in place without `snapshot`
+
+    The installed packages are pure Python, so each runtime gets a python/lib/pythonX.Y/site-packages
+    snapshot of this build's tree, and the build interpreter's own tree is dropped when it isn't a target.
+    With `share_data`, botocore/data moves to python/botocore-data once and the Loader's BUILTIN_DATA_PATH
+    points there from every runtime; boto3/data is small and stays per runtime. The model codec is checked
+    against each runtime and an sts client is created under every interpreter in parallel, which proves the
+    rewritten loaders parse and the models decode there.
+    """
+    codec = CODECS[codec]
+    new_root = Path(f"{layer_root}-multi") if snapshot else Path(layer_root)
+    print("laying out runtimes in", new_root)
+    if snapshot:
+        _checkpoint(layer_root, new_root)
+    package_dir = new_root / "python" / "lib" / PY_VER / "site-packages"
+
+    with ThreadPoolExecutor(max(1, len(pythons))) as pool:
+        facts = dict(zip(pythons, pool.map(_runtime_facts, pythons)))
+    for python in pythons:
+        _check_codec(codec, facts[python])
+
+    ledger = SizeLedger.load(ledger_path(layer_root))
+    if share_data:
+        os.rename(package_dir / "botocore" / "data", new_root / "python" / SHARED_DATA_DIR)
+        _rewrite_file(package_dir / "botocore" / "loaders.py", rewrite_loaders_for_shared_data)
+        ledger.clear("shared")
+        for p, _, files in os.walk(new_root / "python" / SHARED_DATA_DIR):
+            for f in files:
+                ledger.record("shared", os.path.relpath(os.path.join(p, f), new_root / "python"), os.stat(os.path.join(p, f)).st_size)
+    runtimes = {facts[python]["runtime"]: python for python in pythons}
+    # dependencies must have been resolved for these runtimes (build_layer installs them that way)
+    installer.check_installed(installed_versions(package_dir), [runtime[len("python") :] for runtime in runtimes])
+    for runtime in runtimes:
+        if runtime != PY_VER:
+            _checkpoint(package_dir, new_root / "python" / "lib" / runtime / "site-packages")
+    if PY_VER not in runtimes:
+        shutil.rmtree(package_dir.parent)
+
+    with ThreadPoolExecutor(max(1, len(runtimes))) as pool:
+        checks = {
+            runtime: pool.submit(
+                probe, python, (new_root / "python" / "lib" / runtime / "site-packages").resolve(), DEFAULT_WORKLOADS["sts"]
+            )
+            for runtime, python in runtimes.items()
+        }
+    for runtime, check in checks.items():
+        print(f"Validated {runtime}: first client in {1000 * check.result()['first_client_seconds']:.1f}ms")
+    if share_data:
+        print(f"Shared botocore data across {len(runtimes)} runtimes. Size {human_size(ledger.total('shared'))}")
+    ledger.write(ledger_path(new_root))
+    return new_root
+
+
+# deflate level per file suffix when packaging; 0 stores the file. Gzipped models are already compressed.
+ZIP_LEVELS = {".gz": 0}
+# zip timestamps can't go earlier than 1980
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+
+def _zip_level(name: str, levels: t.Dict[str, int]) -> int:
+    return next((level for suffix, level in levels.items() if name.endswith(suffix)), ZIP_LEVEL)
+
+
+def _ledger_key(archive_name: str) -> str:
+    """Path of a layer zip entry relative to site-packages, which is what SizeLedger classifies"""
+    parts = archive_name.split("/")
+    if parts[1] == SHARED_DATA_DIR:
+        return "/".join(("botocore", "data", *parts[2:]))
+    return "/".join(parts[4:]) if parts[1] == "lib" else archive_name
+
+
+@telemetry.staged("package")
+def package_layer(layer_root, zip_path: Path = None, levels: t.Dict[str, int] = None) -> Path:
+    """Zip the layer into <layer>.zip so identical trees always give byte-identical archives
+
+    CDK zips an asset directory with file mtimes and directory order, so a rebuilt but unchanged layer
+    could hash differently and be uploaded again. Entries here are sorted, carry ZIP_EPOCH and plain
+    0644/0755 permissions, and are deflated at the level of the first suffix in `levels` they end with
+    (ZIP_LEVELS by default, ZIP_LEVEL for the rest; an empty suffix matches every file). The compressed
+    size of each entry goes to the "packaged" ledger stage. Directories get entries of their own, since
+    the Loader skips search paths that don't exist and a stage may leave one empty.
+    """
+    layer_root = Path(layer_root)
+    levels = ZIP_LEVELS if levels is None else levels
+    zip_path = Path(zip_path or f"{layer_root}.zip")
+    entries = sorted(
+        os.path.relpath(os.path.join(p, f), layer_root).replace(os.sep, "/") for p, _, files in os.walk(layer_root) for f in files
+    )
+    directories = [
+        os.path.relpath(os.path.join(p, d), layer_root).replace(os.sep, "/") + "/" for p, dirs, _ in os.walk(layer_root) for d in dirs
+    ]
+    ledger = SizeLedger.load(ledger_path(layer_root))
+    ledger.clear("packaged")
+    with _replacing(zip_path, "wb") as f, zipfile.ZipFile(f, "w") as archive:
+        # a directory's name ends with "/", so it sorts right before its contents
+        for name in sorted(entries + directories):
+            if name.endswith("/"):
+                info = zipfile.ZipInfo(name, ZIP_EPOCH)
+                info.create_system = 3
+                info.external_attr = (0o40755 << 16) | 0x10
+                archive.writestr(info, b"")
+                continue
+            info = zipfile.ZipInfo(name, ZIP_EPOCH)
+            info.create_system = 3
+            info.external_attr = (0o100755 if os.access(layer_root / name, os.X_OK) else 0o100644) << 16
+            level = _zip_level(name, levels)
+            info.compress_type = zipfile.ZIP_DEFLATED if level else zipfile.ZIP_STORED
+            with open(layer_root / name, "rb") as source:
+                archive.writestr(info, source.read(), compresslevel=level or None)
+            ledger.record("packaged", _ledger_key(name), archive.getinfo(name).compress_size)
+    if ledger_path(layer_root).exists():
+        ledger.write(ledger_path(layer_root))
+    telemetry.record(files=len(entries), bytes_out=os.stat(zip_path).st_size)
+    print(f"Packaged {len(entries)} files into {zip_path}. Size {human_size(os.stat(zip_path).st_size)}")
+    return zip_path
+
+
+def _unzip_seconds(zip_path: Path, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as target:
+            start = time.perf_counter()
+            with zipfile.ZipFile(zip_path) as archive:
+                archive.extractall(target)
+            timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def compare_zip_levels(layer_root, variants: t.Dict[str, t.Dict[str, int]] = None, repeat: int = 5, report_path: Path = None) -> dict:
+    """Zip size against extraction time for packaging variants, each a suffix to deflate level map
+
+    Lambda downloads and unpacks every layer on a cold start, so a smaller archive is only a win while
+    inflating it costs less than the bytes saved. Each variant is packaged twice to check it is deterministic.
+    """
+    variants = variants or {
+        "stored": {"": 0},
+        "fast": {".gz": 0, "": 1},
+        "default": ZIP_LEVELS,
+        "models-stored": {".gz": 0, ".pickle": 0, ".marshal": 0, ".bundle": 0, ".shapes": 0},
+        "best": {".gz": 0, "": 9},
+    }
+    report = {}
+    with tempfile.TemporaryDirectory() as scratch:
+        for label, levels in variants.items():
+            first = package_layer(layer_root, Path(scratch) / f"{label}.zip", levels)
+            digest = hashlib.sha256(first.read_bytes()).hexdigest()
+            again = package_layer(layer_root, Path(scratch) / f"{label}-again.zip", levels)
+            report[label] = {
+                "levels": levels,
+                "bytes": os.stat(first).st_size,
+                "unzip_seconds": _unzip_seconds(first, repeat),
+                "deterministic": digest == hashlib.sha256(again.read_bytes()).hexdigest(),
+                "sha256": digest,
+            }
+    for label, result in sorted(report.items(), key=lambda item: item[1]["bytes"]):
+        print(
+            f"{label:<14} {human_size(result['bytes']):>8}  unzip {1000 * result['unzip_seconds']:>7.1f}ms"
+            f"{'' if result['deterministic'] else '  NOT DETERMINISTIC'}"
+        )
+    if report_path is not None:
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
 
 
 def _add_import(import_statement: str, target: ast.Module) -> None:
@@ -249,26 +1970,87 @@ def services_by_path(locations, type_name):
     return ast.unparse(original_ast)
 
 
-def rewrite_loaders_for_pickling(python_code: str) -> str:
+def _prepend_statements(code: str, function: ast.FunctionDef) -> None:
+    """Insert statements at the top of a function body, after its docstring"""
+    has_docstring = isinstance(function.body[0], ast.Expr) and isinstance(function.body[0].value, ast.Constant)
+    index = 1 if has_docstring else 0
+    function.body[index:index] = ast.parse(code).body
+
+
+def rewrite_loaders_for_index(python_code: str) -> str:
+    """Answer Loader listing calls from the build-time service index instead of the filesystem
+
+    The index only describes botocore/data and boto3/data, so a Loader with any other search path that
+    exists on disk (like ~/.aws/models) falls through to the original method bodies.
+    """
     if not hasattr(ast, "unparse"):
         raise NotImplementedError("Python 3.9+ required for AST rewriting")
     original_ast = ast.parse(python_code)
-    _add_import("import pickle", original_ast)
+
+    _add_import("from functools import lru_cache", original_ast)
+    _add_import("from botocore._service_index import SERVICES as SERVICE_INDEX", original_ast)
+
+    _, _loader = _find_class("Loader", original_ast)
+    _, available_services = _find_function("list_available_services", _loader)
+    _prepend_statements(
+        """
+if use_service_index(tuple(self.search_paths)):
+    return sorted(s for s, versions in SERVICE_INDEX.items() if any(type_name in types for types in versions.values()))
+""",
+        available_services,
+    )
+    _, api_versions = _find_function("list_api_versions", _loader)
+    _prepend_statements(
+        """
+if use_service_index(tuple(self.search_paths)):
+    known_api_versions = [v for v, types in SERVICE_INDEX.get(service_name, {}).items() if type_name in types]
+    if not known_api_versions:
+        raise DataNotFoundError(data_path=service_name)
+    return sorted(known_api_versions)
+""",
+        api_versions,
+    )
+
+    original_ast.body.extend(
+        ast.parse(
+            """
+@lru_cache(20)
+def use_service_index(search_paths):
+    indexed = (
+        os.path.normpath(Loader.BUILTIN_DATA_PATH),
+        os.path.normpath(os.path.join(os.path.dirname(BOTOCORE_ROOT), 'boto3', 'data')),
+    )
+    return all(os.path.normpath(p) in indexed or not os.path.isdir(p) for p in search_paths)"""
+        ).body
+    )
+
+    return ast.unparse(original_ast)
+
+
+def rewrite_loaders_for_codec(python_code: str, codec: str) -> str:
+    """Insert a FileLoader for the codec's model files and make it the Loader default"""
+    if not hasattr(ast, "unparse"):
+        raise NotImplementedError("Python 3.9+ required for AST rewriting")
+    codec = CODECS[codec]
+    if codec.loader_expression is None:
+        return python_code
+    original_ast = ast.parse(python_code)
+    _add_import(codec.loader_import, original_ast)
 
     json_loader_index, _ = _find_class("JSONFileLoader", original_ast)
 
     original_ast.body.insert(
         json_loader_index,
         ast.parse(
-            """
-class PickleFileLoader(object):
+            f"""
+class {codec.loader_class}(object):
     '''Inserted by uboto'''
     def exists(self, file_path):
-        return os.path.isfile(file_path + '.pickle')
+        return os.path.isfile(file_path + '{codec.suffix}')
     def load_file(self, file_path):
         try:
-            with open(file_path + '.pickle', 'rb') as fp:
-                return pickle.load(fp)
+            with open(file_path + '{codec.suffix}', 'rb') as fp:
+                return {codec.loader_expression}
         except (IsADirectoryError, FileNotFoundError):
             ..."""
         ).body,
@@ -276,6 +2058,652 @@ class PickleFileLoader(object):
 
     _, _loader = _find_class("Loader", original_ast)
     assert "FILE_LOADER_CLASS" in [t.id for t in _loader.body[1].targets]
-    _loader.body[1] = ast.parse("FILE_LOADER_CLASS = PickleFileLoader").body
+    _loader.body[1] = ast.parse(f"FILE_LOADER_CLASS = {codec.loader_class}").body
+
+    return ast.unparse(original_ast)
+
+
+def rewrite_loaders_for_pickling(python_code: str) -> str:
+    return rewrite_loaders_for_codec(python_code, "pickle")
+
+
+def rewrite_loaders_for_bundle(python_code: str, codec: str) -> str:
+    """Insert a FileLoader serving models out of the memory-mapped bundle and make it the Loader default
+
+    Paths missing from the bundle go to whichever FileLoader was the default before.
+    """
+    if not hasattr(ast, "unparse"):
+        raise NotImplementedError("Python 3.9+ required for AST rewriting")
+    codec = CODECS[codec]
+    original_ast = ast.parse(python_code)
+    _add_import("import mmap", original_ast)
+    _add_import("import struct", original_ast)
+    _add_import("from functools import lru_cache", original_ast)
+    if codec.loader_import:
+        _add_import(codec.loader_import, original_ast)
+
+    _, _loader = _find_class("Loader", original_ast)
+    assert "FILE_LOADER_CLASS" in [t.id for t in _loader.body[1].targets]
+    fallback = _loader.body[1].value.id
+    _loader.body[1] = ast.parse("FILE_LOADER_CLASS = BundleFileLoader").body
+
+    loader_index, _ = _find_class("Loader", original_ast)
+    original_ast.body[loader_index:loader_index] = ast.parse(
+        f"""
+MODEL_BUNDLE = '{BUNDLE_NAME}'
+@lru_cache(1)
+def model_bundle():
+    try:
+        with open(os.path.join(Loader.BUILTIN_DATA_PATH, MODEL_BUNDLE), 'rb') as fp:
+            bundle = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return None, {{}}
+    header_length, = struct.unpack_from('<Q', bundle, {len(BUNDLE_MAGIC)})
+    base = {len(BUNDLE_MAGIC) + 8} + header_length
+    index = json.loads(bundle[base - header_length:base])
+    return memoryview(bundle), {{key: entry and (base + entry[0], base + entry[0] + entry[1]) for key, entry in index.items()}}
+def bundle_entry(file_path):
+    '''Span of a model in the bundle, None if it has to be looked up on disk and False if the layer lacks it'''
+    bundle, index = model_bundle()
+    # bundle keys are relative to site-packages, wherever the botocore data was laid out
+    key = os.path.relpath(file_path, Loader.BUILTIN_DATA_PATH)
+    if key.startswith(os.pardir):
+        key = os.path.relpath(file_path, os.path.dirname(BOTOCORE_ROOT))
+    else:
+        key = os.path.join('botocore', 'data', key)
+    if key in index:
+        return index[key]
+    return None if bundle is None or key.startswith(os.pardir) else False
+class BundleFileLoader(object):
+    '''Inserted by uboto'''
+    def exists(self, file_path):
+        span = bundle_entry(file_path)
+        return {fallback}().exists(file_path) if span is None else bool(span)
+    def load_file(self, file_path):
+        span = bundle_entry(file_path)
+        if span is None:
+            return {fallback}().load_file(file_path)
+        if not span:
+            return None
+        data = model_bundle()[0][span[0]:span[1]]
+        return {codec.buffer_expression}"""
+    ).body
+
+    return ast.unparse(original_ast)
+
+
+def rewrite_loaders_for_shared_data(python_code: str) -> str:
+    """Point the Loader's BUILTIN_DATA_PATH at the runtime-independent python/botocore-data"""
+    if not hasattr(ast, "unparse"):
+        raise NotImplementedError("Python 3.9+ required for AST rewriting")
+    original_ast = ast.parse(python_code)
+
+    _, _loader = _find_class("Loader", original_ast)
+    index, statement = next(
+        (i, s) for i, s in enumerate(_loader.body) if isinstance(s, ast.Assign) and [t.id for t in s.targets] == ["BUILTIN_DATA_PATH"]
+    )
+    # site-packages is python/lib/pythonX.Y/site-packages
+    _loader.body[index] = ast.parse(
+        "BUILTIN_DATA_PATH = os.path.normpath("
+        f"os.path.join(os.path.dirname(BOTOCORE_ROOT), os.pardir, os.pardir, os.pardir, '{SHARED_DATA_DIR}'))"
+    ).body[0]
+
+    return ast.unparse(original_ast)
+
+
+class _LazyModelCalls(ast.NodeTransformer):
+    def visit_Call(self, node: ast.Call):
+        self.generic_visit(node)
+        func = node.func
+        if isinstance(func, ast.Attribute) and func.attr == "load_file" and getattr(func.value, "attr", None) == "file_loader":
+            return ast.Call(func=ast.Name(id="with_lazy_shapes", ctx=ast.Load()), args=[node, node.args[0]], keywords=[])
+        return node
+
+
+def rewrite_loaders_for_split(python_code: str, codec: str) -> str:
+    """Give split models a shape map that decodes chunks from the .shapes file on first use
+
+    Every file_loader.load_file call in Loader is wrapped, so this works whichever FileLoader is the default.
+    """
+    if not hasattr(ast, "unparse"):
+        raise NotImplementedError("Python 3.9+ required for AST rewriting")
+    codec = CODECS[codec]
+    original_ast = ast.parse(python_code)
+    _add_import("import copy", original_ast)
+    _add_import("import mmap", original_ast)
+    _add_import("import struct", original_ast)
+    if codec.loader_import:
+        _add_import(codec.loader_import, original_ast)
+
+    loader_index, _loader = _find_class("Loader", original_ast)
+    _LazyModelCalls().visit(_loader)
+    ast.fix_missing_locations(original_ast)
+
+    original_ast.body[loader_index:loader_index] = ast.parse(
+        f"""
+class LazyShapes(dict):
+    '''Inserted by uboto. A shape map that decodes a chunk of shapes the first time one of them is looked up
+
+    _chunk_of holds the names not decoded yet, so each name is either pending there or in the dict itself.
+    Copies and pickles decode everything and are plain dicts.'''
+    def __init__(self, path, chunk_of):
+        super().__init__()
+        self._path = path
+        self._chunk_of = dict(chunk_of)
+        self._spans = None
+    def _load_chunk(self, chunk):
+        if self._spans is None:
+            with open(self._path, 'rb') as fp:
+                self._buffer = memoryview(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ))
+            header_length, = struct.unpack_from('<Q', self._buffer, {len(SHAPES_MAGIC)})
+            base = {len(SHAPES_MAGIC) + 8} + header_length
+            header = json.loads(bytes(self._buffer[base - header_length:base]))
+            self._spans = [(base + offset, base + offset + length) for offset, length in header]
+        start, end = self._spans[chunk]
+        data = self._buffer[start:end]
+        for name, shape in ({codec.buffer_expression}).items():
+            # names set or deleted since are no longer pending and keep what was done to them
+            if self._chunk_of.pop(name, None) is not None:
+                dict.__setitem__(self, name, shape)
+    def _load_all(self):
+        for chunk in sorted(set(self._chunk_of.values())):
+            self._load_chunk(chunk)
+    def __missing__(self, name):
+        if name not in self._chunk_of:
+            raise KeyError(name)
+        self._load_chunk(self._chunk_of[name])
+        return dict.__getitem__(self, name)
+    def __setitem__(self, name, shape):
+        self._chunk_of.pop(name, None)
+        dict.__setitem__(self, name, shape)
+    def __delitem__(self, name):
+        if self._chunk_of.pop(name, None) is None:
+            dict.__delitem__(self, name)
+    def __contains__(self, name):
+        return name in self._chunk_of or dict.__contains__(self, name)
+    def __iter__(self):
+        return iter([*self._chunk_of, *dict.keys(self)])
+    def __len__(self):
+        return len(self._chunk_of) + dict.__len__(self)
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+    def pop(self, name, *default):
+        if name in self:
+            shape = self[name]
+            dict.__delitem__(self, name)
+            return shape
+        if default:
+            return default[0]
+        raise KeyError(name)
+    def popitem(self):
+        self._load_all()
+        return dict.popitem(self)
+    def setdefault(self, name, default=None):
+        if name in self:
+            return self[name]
+        self[name] = default
+        return default
+    def update(self, *args, **kwargs):
+        for name, shape in dict(*args, **kwargs).items():
+            self[name] = shape
+    def __ior__(self, other):
+        self.update(other)
+        return self
+    def __or__(self, other):
+        merged = self.copy()
+        merged.update(other)
+        return merged
+    def clear(self):
+        self._chunk_of.clear()
+        dict.clear(self)
+    def keys(self):
+        return list(self)
+    def values(self):
+        self._load_all()
+        return dict.values(self)
+    def items(self):
+        self._load_all()
+        return dict.items(self)
+    def copy(self):
+        self._load_all()
+        return dict(dict.items(self))
+    def __reduce__(self):
+        return (dict, (self.copy(),))
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(self.copy(), memo)
+    def __eq__(self, other):
+        self._load_all()
+        return dict.__eq__(self, other)
+    def __ne__(self, other):
+        self._load_all()
+        return dict.__ne__(self, other)
+    def __repr__(self):
+        self._load_all()
+        return dict.__repr__(self)
+def with_lazy_shapes(model, file_path):
+    if isinstance(model, dict) and 'shapeChunks' in model:
+        model = dict(model)
+        model['shapes'] = LazyShapes(file_path + '.shapes', model.pop('shapeChunks'))
+    return model"""
+    ).body
+
+    return ast.unparse(original_ast)
+
+
+def rewrite_loaders_for_model_cache(python_code: str, maxsize: int = 64) -> str:
+    """Back Loader.load_service_model and load_data_with_path with a bounded LRU cache shared by the process
+
+    Entries are keyed by method, search paths, FileLoader class, extras types and arguments, so Loaders
+    that would find different files never share them. Missing data is cached as its DataNotFoundError.
+    UBOTO_MODEL_CACHE_SIZE overrides `maxsize` at runtime and 0 turns the cache off; model_cache_info()
+    reports hits, misses and evictions, and model_cache_clear() empties it.
+    """
+    if not hasattr(ast, "unparse"):
+        raise NotImplementedError("Python 3.9+ required for AST rewriting")
+    original_ast = ast.parse(python_code)
+    _add_import("import collections", original_ast)
+    _add_import("import functools", original_ast)
+    _add_import("import threading", original_ast)
+
+    loader_index, _loader = _find_class("Loader", original_ast)
+    for name in ("load_service_model", "load_data_with_path"):
+        # below instance_cache, so a Loader still answers repeat calls from its own cache first
+        _find_function(name, _loader)[1].decorator_list.append(ast.Name("process_cache", ast.Load()))
+
+    original_ast.body[loader_index:loader_index] = ast.parse(
+        f"""
+MODEL_CACHE_SIZE = int(os.environ.get('UBOTO_MODEL_CACHE_SIZE', {maxsize}))
+_model_cache = collections.OrderedDict()
+_model_cache_lock = threading.Lock()
+_model_cache_stats = {{'hits': 0, 'misses': 0, 'evictions': 0}}
+def model_cache_info():
+    '''Inserted by uboto'''
+    with _model_cache_lock:
+        return dict(_model_cache_stats, currsize=len(_model_cache), maxsize=MODEL_CACHE_SIZE)
+def model_cache_clear():
+    '''Inserted by uboto'''
+    with _model_cache_lock:
+        _model_cache.clear()
+        _model_cache_stats.update(hits=0, misses=0, evictions=0)
+def process_cache(func):
+    '''Inserted by uboto. Models are loaded outside the lock, so two threads missing at once both load'''
+    @functools.wraps(func)
+    def _wrapper(self, *args, **kwargs):
+        if MODEL_CACHE_SIZE <= 0:
+            return func(self, *args, **kwargs)
+        key = (func.__name__, tuple(self.search_paths), type(self.file_loader), tuple(self.extras_types))
+        key += args + tuple(sorted(kwargs.items()))
+        with _model_cache_lock:
+            found = _model_cache.get(key)
+            if found is not None:
+                _model_cache.move_to_end(key)
+                _model_cache_stats['hits'] += 1
+            else:
+                _model_cache_stats['misses'] += 1
+        if found is None:
+            try:
+                found = (True, func(self, *args, **kwargs))
+            except DataNotFoundError as e:
+                found = (False, e)
+            with _model_cache_lock:
+                _model_cache[key] = found
+                while len(_model_cache) > MODEL_CACHE_SIZE:
+                    _model_cache.popitem(last=False)
+                    _model_cache_stats['evictions'] += 1
+        if not found[0]:
+            raise found[1].with_traceback(None)
+        return found[1]
+    return _wrapper"""
+    ).body
+
+    return ast.unparse(original_ast)
+
+
+def _event_prefix(node: ast.expr) -> t.Optional[str]:
+    """The literal start of an event name built as 'name.%s' % ... or f'name.{...}'"""
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Mod) and isinstance(node.left, ast.Constant):
+        return node.left.value.split("%", 1)[0]
+    if isinstance(node, ast.JoinedStr) and node.values and isinstance(node.values[0], ast.Constant):
+        return node.values[0].value
+    return None
+
+
+def rewrite_client_for_class_cache(python_code: str, maxsize: int = 128) -> str:
+    """Reuse generated client classes across ClientCreators, so every Session builds each class only once
+
+    Building a class creates a method per operation, which is most of the cost of a repeat client. The
+    methods and name mapping are cached per service, API version and operation names. The
+    creating-client-class event still runs on every call, and the finished class is keyed on the identity of
+    whatever its handlers added, replaced or removed, so sessions with different handlers get different
+    classes. Config, credentials and endpoints live on the client instance and are untouched. A cached class
+    keeps the docstring hooks of the session that built it. UBOTO_CLIENT_CLASS_CACHE_SIZE overrides
+    `maxsize` at runtime and client_class_cache_info() reports hits, misses and evictions.
+    """
+    if not hasattr(ast, "unparse"):
+        raise NotImplementedError("Python 3.9+ required for AST rewriting")
+    original_ast = ast.parse(python_code)
+    _add_import("import collections", original_ast)
+    _add_import("import os", original_ast)
+    _add_import("import threading", original_ast)
+
+    creator_index, _creator = _find_class("ClientCreator", original_ast)
+    _, create_class = _find_function("_create_client_class", _creator)
+    calls = [node for node in ast.walk(create_class) if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)]
+    assert any(call.func.attr == "_create_methods" for call in calls)
+    # botocore formats the event name with % in older releases and with an f-string in newer ones
+    assert any(call.func.attr == "emit" and _event_prefix(call.args[0]) == "creating-client-class." for call in calls if call.args)
+    create_class.body = ast.parse(
+        """
+template_key = (service_name, service_model.api_version, tuple(service_model.operation_names))
+with _client_class_lock:
+    template = _client_templates.get(template_key)
+if template is None:
+    template = self._create_methods(service_model)
+    template['_PY_TO_OP_NAME'] = self._create_name_mapping(service_model)
+    with _client_class_lock:
+        _client_templates[template_key] = template
+class_attributes = dict(template)
+bases = [BaseClient]
+service_id = service_model.service_id.hyphenize()
+self._event_emitter.emit('creating-client-class.%s' % service_id, class_attributes=class_attributes, base_classes=bases)
+# the cached class holds everything keyed here by id, so no id can be reused while its entry exists
+changed = tuple(sorted((name, id(value)) for name, value in class_attributes.items() if template.get(name, _missing) is not value))
+key = (template_key, changed, frozenset(template.keys() - class_attributes.keys()), tuple(map(id, bases)))
+return client_class(key, lambda: type(str(get_service_module_name(service_model)), tuple(bases), class_attributes))
+"""
+    ).body
+
+    original_ast.body[creator_index:creator_index] = ast.parse(
+        f"""
+CLIENT_CLASS_CACHE_SIZE = int(os.environ.get('UBOTO_CLIENT_CLASS_CACHE_SIZE', {maxsize}))
+_missing = object()
+_client_templates = {{}}
+_client_classes = collections.OrderedDict()
+_client_class_lock = threading.Lock()
+_client_class_stats = {{'hits': 0, 'misses': 0, 'evictions': 0}}
+def client_class_cache_info():
+    '''Inserted by uboto'''
+    with _client_class_lock:
+        return dict(_client_class_stats, currsize=len(_client_classes), maxsize=CLIENT_CLASS_CACHE_SIZE)
+def client_class(key, create):
+    '''Inserted by uboto. The cached class for `key`, made with `create` on a miss'''
+    if CLIENT_CLASS_CACHE_SIZE <= 0:
+        return create()
+    with _client_class_lock:
+        cls = _client_classes.get(key)
+        if cls is not None:
+            _client_classes.move_to_end(key)
+            _client_class_stats['hits'] += 1
+            return cls
+        _client_class_stats['misses'] += 1
+    cls = create()
+    with _client_class_lock:
+        _client_classes[key] = cls
+        while len(_client_classes) > CLIENT_CLASS_CACHE_SIZE:
+            _client_classes.popitem(last=False)
+            _client_class_stats['evictions'] += 1
+    return cls"""
+    ).body
+
+    return ast.unparse(original_ast)
+
+
+def rewrite_regions_for_endpoint_table(python_code: str) -> str:
+    """Resolve endpoints from the build-time endpoint table, building an EndpointProvider only on a miss
+
+    PrecomputedEndpointResolver loads endpoints.json on the first lookup the table can't answer, and
+    PrecomputedRuleset stands in for a service's ruleset until a request needs parameters it lacks.
+    """
+    if not hasattr(ast, "unparse"):
+        raise NotImplementedError("Python 3.9+ required for AST rewriting")
+    original_ast = ast.parse(python_code)
+    _add_import("from botocore._endpoint_table import LEGACY as LEGACY_ENDPOINTS, RULESETS, RULESET_ENDPOINTS", original_ast)
+    _add_import("from botocore.endpoint_provider import RuleSet, RuleSetEndpoint", original_ast)
+
+    resolver_index, _resolver = _find_class("EndpointResolver", original_ast)
+    _, construct = _find_function("construct_endpoint", _resolver)
+    assert [a.arg for a in construct.args.args] == [
+        "self",
+        "service_name",
+        "region_name",
+        "partition_name",
+        "use_dualstack_endpoint",
+        "use_fips_endpoint",
+    ]
+    _, available = _find_function("get_available_endpoints", _resolver)
+    assert [a.arg for a in available.args.args] == ["self", "service_name", "partition_name", "allow_non_regional", "endpoint_variant_tags"]
+    original_ast.body[resolver_index + 1 : resolver_index + 1] = ast.parse(
+        """
+class PrecomputedEndpointResolver(EndpointResolver):
+    '''Inserted by uboto. Answers the lookups seen at build time from the endpoint table, and loads
+    endpoints.json with `load` for anything else'''
+
+    def __init__(self, load):
+        self._load = load
+        self._loaded = None
+        self.uses_builtin_data = True
+
+    @property
+    def _endpoint_data(self):
+        if self._loaded is None:
+            self._loaded = self._load()
+        return self._loaded
+
+    def construct_endpoint(
+        self, service_name, region_name=None, partition_name=None, use_dualstack_endpoint=False, use_fips_endpoint=False
+    ):
+        key = ('construct_endpoint', service_name, region_name, partition_name, bool(use_dualstack_endpoint), bool(use_fips_endpoint))
+        if key in LEGACY_ENDPOINTS:
+            return copy.deepcopy(LEGACY_ENDPOINTS[key])
+        return super().construct_endpoint(service_name, region_name, partition_name, use_dualstack_endpoint, use_fips_endpoint)
+
+    def get_available_endpoints(self, service_name, partition_name='aws', allow_non_regional=False, endpoint_variant_tags=None):
+        key = ('get_available_endpoints', service_name, partition_name, bool(allow_non_regional))
+        if not endpoint_variant_tags and key in LEGACY_ENDPOINTS:
+            return list(LEGACY_ENDPOINTS[key])
+        return super().get_available_endpoints(service_name, partition_name, allow_non_regional, endpoint_variant_tags)
+
+
+class PrecomputedRuleset:
+    '''Inserted by uboto. A service's endpoint ruleset as far as the endpoint table knows it; `load` reads the
+    ruleset itself'''
+
+    def __init__(self, service_name, load):
+        self.service_name = service_name
+        self.parameters = RuleSet(**RULESETS[service_name], rules=[], partitions=None).parameters
+        self.load = load
+
+    def resolve(self, params):
+        try:
+            found = RULESET_ENDPOINTS.get((self.service_name, tuple(sorted(params.items()))))
+        except TypeError:
+            # list parameters can't be table keys
+            return None
+        if found is not None:
+            url, properties, headers = found
+            return RuleSetEndpoint(url=url, properties=copy.deepcopy(properties), headers=copy.deepcopy(headers))"""
+    ).body
+
+    _, _ruleset_resolver = _find_class("EndpointRulesetResolver", original_ast)
+    _, init = _find_function("__init__", _ruleset_resolver)
+    assert ast.unparse(init.body[0]).startswith("self._provider = EndpointProvider(")
+    assert ast.unparse(init.body[1]) == "self._param_definitions = self._provider.ruleset.parameters"
+    init.body[:2] = ast.parse(
+        """
+self._ruleset_data = endpoint_ruleset_data
+self._partition_data = partition_data
+self._endpoint_provider = None
+if isinstance(endpoint_ruleset_data, PrecomputedRuleset):
+    self._param_definitions = endpoint_ruleset_data.parameters
+else:
+    self._param_definitions = self._provider.ruleset.parameters"""
+    ).body
+    _ruleset_resolver.body[1:1] = ast.parse(
+        """
+@property
+def _provider(self):
+    '''Inserted by uboto'''
+    if self._endpoint_provider is None:
+        ruleset_data = self._ruleset_data
+        if isinstance(ruleset_data, PrecomputedRuleset):
+            ruleset_data = ruleset_data.load()
+        self._endpoint_provider = EndpointProvider(ruleset_data=ruleset_data, partition_data=self._partition_data)
+    return self._endpoint_provider"""
+    ).body
+
+    _, construct = _find_function("construct_endpoint", _ruleset_resolver)
+    resolve = next(s for s in construct.body if isinstance(s, ast.Try))
+    assert ast.unparse(resolve.body[0]) == "provider_result = self._provider.resolve_endpoint(**provider_params)"
+    resolve.body[:1] = ast.parse(
+        """
+provider_result = None
+if isinstance(self._ruleset_data, PrecomputedRuleset):
+    provider_result = self._ruleset_data.resolve(provider_params)
+if provider_result is None:
+    provider_result = self._provider.resolve_endpoint(**provider_params)"""
+    ).body
+
+    return ast.unparse(original_ast)
+
+
+def rewrite_client_for_endpoint_table(python_code: str) -> str:
+    """Hand EndpointRulesetResolver a PrecomputedRuleset for services in the endpoint table
+
+    Only the latest API version was resolved at build time, and like the service index the table is ignored
+    when a data path outside the layer exists.
+    """
+    if not hasattr(ast, "unparse"):
+        raise NotImplementedError("Python 3.9+ required for AST rewriting")
+    original_ast = ast.parse(python_code)
+    _add_import("from botocore.loaders import use_service_index", original_ast)
+    _add_import("from botocore.regions import RULESETS, PrecomputedRuleset", original_ast)
+    _add_import("from functools import partial", original_ast)
+
+    _, _creator = _find_class("ClientCreator", original_ast)
+    _, load_ruleset = _find_function("_load_service_endpoints_ruleset", _creator)
+    _prepend_statements(
+        """
+if api_version is None and service_name in RULESETS and use_service_index(tuple(self._loader.search_paths)):
+    return PrecomputedRuleset(service_name, partial(self._loader.load_service_model, service_name, 'endpoint-rule-set-1'))
+""",
+        load_ruleset,
+    )
+
+    return ast.unparse(original_ast)
+
+
+def rewrite_session_for_endpoint_table(python_code: str) -> str:
+    """Give sessions a PrecomputedEndpointResolver, which only loads endpoints.json on a table miss"""
+    if not hasattr(ast, "unparse"):
+        raise NotImplementedError("Python 3.9+ required for AST rewriting")
+    original_ast = ast.parse(python_code)
+    _add_import("from botocore.loaders import use_service_index", original_ast)
+    _add_import("from botocore.regions import PrecomputedEndpointResolver", original_ast)
+    _add_import("from functools import partial", original_ast)
+
+    _, _session = _find_class("Session", original_ast)
+    _, register = _find_function("_register_endpoint_resolver", _session)
+    _, create_resolver = _find_function("create_default_resolver", register)
+    assert ast.unparse(create_resolver.body[0]) == "loader = self.get_component('data_loader')"
+    create_resolver.body[1:1] = ast.parse(
+        """
+if use_service_index(tuple(loader.search_paths)):
+    return PrecomputedEndpointResolver(partial(loader.load_data, 'endpoints'))"""
+    ).body
+
+    return ast.unparse(original_ast)
+
+
+def rewrite_loaders_for_low_memory(python_code: str, document_cache_size: int = 2) -> str:
+    """Let Loaders forget service models once built into a ServiceModel, and bound their other documents
+
+    release_model(loader, model) drops a Loader's cached references to a model; the rewritten client.py and
+    session.py call it as soon as a ServiceModel holds it. Paginator and waiter documents are only needed
+    while a client builds a paginator or waiter, so each Loader keeps just the last few of them.
+    UBOTO_DOCUMENT_CACHE_SIZE overrides `document_cache_size` at runtime and 0 keeps none.
+    """
+    if not hasattr(ast, "unparse"):
+        raise NotImplementedError("Python 3.9+ required for AST rewriting")
+    original_ast = ast.parse(python_code)
+    _add_import("import collections", original_ast)
+    _add_import("import functools", original_ast)
+    _add_import("import threading", original_ast)
+
+    loader_index, _loader = _find_class("Loader", original_ast)
+    # above instance_cache, so the bounded cache is consulted first and the Loader's own is emptied after
+    _find_function("load_service_model", _loader)[1].decorator_list.insert(0, ast.Name("bounded_documents", ast.Load()))
+
+    original_ast.body[loader_index:loader_index] = ast.parse(
+        f"""
+DOCUMENT_CACHE_SIZE = int(os.environ.get('UBOTO_DOCUMENT_CACHE_SIZE', {document_cache_size}))
+BOUNDED_DOCUMENTS = ('paginators-1', 'waiters-2')
+_document_lock = threading.Lock()
+def release_model(loader, model):
+    '''Inserted by uboto. Drop `loader`'s cached references to a loaded model'''
+    cache = getattr(loader, '_cache', None)
+    if cache is None:
+        return
+    with _document_lock:
+        for key, value in list(cache.items()):
+            if value is model or (isinstance(value, tuple) and value and value[0] is model):
+                cache.pop(key, None)
+def bounded_documents(func):
+    '''Inserted by uboto. Keeps only the last DOCUMENT_CACHE_SIZE BOUNDED_DOCUMENTS a Loader loaded'''
+    @functools.wraps(func)
+    def _wrapper(self, service_name, type_name, api_version=None):
+        if type_name not in BOUNDED_DOCUMENTS:
+            return func(self, service_name, type_name, api_version=api_version)
+        key = (service_name, type_name, api_version)
+        with _document_lock:
+            documents = self.__dict__.setdefault('_bounded_documents', collections.OrderedDict())
+            document = documents.get(key)
+            if document is not None:
+                documents.move_to_end(key)
+                return document
+        document = func(self, service_name, type_name, api_version=api_version)
+        release_model(self, document)
+        if DOCUMENT_CACHE_SIZE > 0:
+            with _document_lock:
+                documents[key] = document
+                while len(documents) > DOCUMENT_CACHE_SIZE:
+                    documents.popitem(last=False)
+        return document
+    return _wrapper"""
+    ).body
+
+    return ast.unparse(original_ast)
+
+
+def rewrite_client_for_low_memory(python_code: str) -> str:
+    """Release the service model from the Loader as soon as ClientCreator has built its ServiceModel"""
+    if not hasattr(ast, "unparse"):
+        raise NotImplementedError("Python 3.9+ required for AST rewriting")
+    original_ast = ast.parse(python_code)
+    _add_import("from botocore.loaders import release_model", original_ast)
+
+    _, _creator = _find_class("ClientCreator", original_ast)
+    _, load_model = _find_function("_load_service_model", _creator)
+    assert ast.unparse(load_model.body[-1]) == "return service_model"
+    load_model.body[-1:-1] = ast.parse("release_model(self._loader, json_model)").body
+
+    return ast.unparse(original_ast)
+
+
+def rewrite_session_for_low_memory(python_code: str) -> str:
+    """Release the service model from the Loader as soon as Session.get_service_model has built its ServiceModel"""
+    if not hasattr(ast, "unparse"):
+        raise NotImplementedError("Python 3.9+ required for AST rewriting")
+    original_ast = ast.parse(python_code)
+    _add_import("from botocore.loaders import release_model", original_ast)
+
+    _, _session = _find_class("Session", original_ast)
+    _, get_model = _find_function("get_service_model", _session)
+    assert ast.unparse(get_model.body[-1]) == "return ServiceModel(service_description, service_name=service_name)"
+    get_model.body[-1:] = ast.parse(
+        """
+service_model = ServiceModel(service_description, service_name=service_name)
+release_model(self.get_component('data_loader'), service_description)
+return service_model"""
+    ).body
 
     return ast.unparse(original_ast)
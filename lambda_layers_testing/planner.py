@@ -0,0 +1,80 @@
+import threading
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from . import layer_processor
+
+
+class SharedSource:
+    """A prepare_source tree for one boto3 version, prepared by whichever layer first misses the cache"""
+
+    def __init__(self, boto3_version, only_services, transforms, python_versions=None):
+        self.boto3_version = boto3_version
+        self.only_services = only_services
+        self.transforms = transforms
+        self.python_versions = python_versions
+        self._lock = threading.Lock()
+        self._prepared: t.Optional[Path] = None
+
+    def __call__(self) -> Path:
+        with self._lock:
+            if self._prepared is None:
+                self._prepared = layer_processor.prepare_source(
+                    self.boto3_version, self.only_services, self.transforms, python_versions=self.python_versions
+                )
+            return self._prepared
+
+
+class LayerPlanner:
+    """Collects the build_layer calls of a whole app and runs them as one build
+
+    Layers are grouped by boto3 version, transforms and target runtimes. Each group transforms every model file it needs
+    once, for the union of the services its layers keep, and the layers are then linked out of that shared
+    tree concurrently. Layers found in the layer cache never trigger the shared build.
+    """
+
+    def __init__(self, workers: int = None):
+        self.workers = workers
+        self.requests: t.Dict[str, dict] = {}
+        self.callbacks: t.Dict[str, t.Callable[[Path, t.Dict[str, str]], None]] = {}
+
+    def add(self, layer_name: str, callback: t.Callable[[Path, t.Dict[str, str]], None] = None, **settings):
+        """Queue build_layer(layer_name, **settings); `callback` receives its result when the plan runs"""
+        if settings.get("snapshots"):
+            raise ValueError("planned layers are built from a shared source and can't keep stage snapshots")
+        self.requests[layer_name] = settings
+        if callback is not None:
+            self.callbacks[layer_name] = callback
+
+    def groups(self) -> t.Dict[tuple, t.List[str]]:
+        grouped = {}
+        for layer_name, settings in self.requests.items():
+            group = (
+                settings.get("boto3_version"),
+                tuple(settings.get("transforms", layer_processor.DEFAULT_TRANSFORMS)),
+                tuple(layer_processor.target_python_versions(settings.get("runtime_pythons", ())) or ()),
+            )
+            grouped.setdefault(group, []).append(layer_name)
+        return grouped
+
+    def build(self) -> t.Dict[str, t.Tuple[Path, t.Dict[str, str]]]:
+        sources = {}
+        for (boto3_version, transforms, python_versions), layer_names in self.groups().items():
+            wanted = [self.requests[name].get("only_services") for name in layer_names]
+            # one layer keeping every service means the shared tree has to as well
+            union = None if not all(wanted) else sorted(set().union(*wanted))
+            # installs are shared by the group, so they must not race
+            layer_processor.install_boto3(boto3_version, list(python_versions) or None)
+            source = SharedSource(boto3_version, union, transforms, list(python_versions) or None)
+            sources.update(dict.fromkeys(layer_names, source))
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            futures = {
+                name: pool.submit(layer_processor.build_layer, name, prepared=sources[name], **settings)
+                for name, settings in self.requests.items()
+            }
+        results = {name: future.result() for name, future in futures.items()}
+        for name, callback in self.callbacks.items():
+            callback(*results[name])
+        return results
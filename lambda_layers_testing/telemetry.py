@@ -0,0 +1,162 @@
+import json
+import os
+import threading
+import time
+import typing as t
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+
+from .accounting import human_size
+from .installer import CACHE_DIR
+
+# every build appends to the same stream, so builds can be compared over time
+EVENTS_PATH = Path(os.environ.get("LAYER_EVENTS", CACHE_DIR / "events.jsonl"))
+# all events of one process share a build id
+BUILD_ID = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+COUNTERS = ("files", "bytes_in", "bytes_out", "cache_hits", "cache_misses")
+
+_local = threading.local()
+_write_lock = threading.Lock()
+
+
+def _cpu_seconds() -> float:
+    # reaped children count too, which is where process pools do their work
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class StageEvent:
+    """One line of the event stream: timings of a stage plus counters it records while it runs"""
+
+    def __init__(self, name: str, parent: t.Optional[str], fields: dict):
+        self.name = name
+        self.parent = parent
+        self.fields = dict(fields)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def record(self, **values):
+        """Add to the counters; anything else, like the boto3 version a stage built, is stored as given"""
+        for key, value in values.items():
+            if key in self.counters:
+                self.counters[key] += value
+            else:
+                self.fields[key] = value
+
+
+def record(**values):
+    """Record into the innermost stage running in this thread, if any"""
+    stack = getattr(_local, "stack", None)
+    if stack:
+        stack[-1].record(**values)
+
+
+@contextmanager
+def stage(name: str, events_path: Path = None, **fields):
+    """Time a stage and append it to the event stream as a JSON line once it ends
+
+    CPU time is process-wide, so stages of layers a planner builds concurrently overlap in it.
+    """
+    stack = _local.__dict__.setdefault("stack", [])
+    event = StageEvent(name, stack[-1].name if stack else None, fields)
+    stack.append(event)
+    start, cpu = time.time(), _cpu_seconds()
+    status = "error"
+    try:
+        yield event
+        status = "ok"
+    finally:
+        stack.pop()
+        end = time.time()
+        line = {
+            "build": BUILD_ID,
+            "stage": name,
+            "parent": event.parent,
+            "status": status,
+            "start": round(start, 3),
+            "end": round(end, 3),
+            "seconds": round(end - start, 3),
+            "cpu": round(_cpu_seconds() - cpu, 3),
+            **event.counters,
+            **event.fields,
+        }
+        _append(line, events_path or EVENTS_PATH)
+
+
+def _append(line: dict, events_path: Path):
+    events_path.parent.mkdir(parents=True, exist_ok=True)
+    with _write_lock, open(events_path, "a") as f:
+        f.write(json.dumps(line, sort_keys=True) + "\n")
+
+
+def staged(name: str):
+    """Run a layer stage, whose first argument is the layer's name or root, inside stage(name)"""
+
+    def decorate(func):
+        @wraps(func)
+        def wrapper(layer, *args, **kwargs):
+            with stage(name, layer=Path(layer).name):
+                return func(layer, *args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def load_events(events_path: Path = EVENTS_PATH) -> t.List[dict]:
+    if not Path(events_path).exists():
+        return []
+    with open(events_path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def builds(events: t.List[dict]) -> t.List[str]:
+    """Build ids in the order they started"""
+    started = {}
+    for event in events:
+        started[event["build"]] = min(started.get(event["build"], event["start"]), event["start"])
+    return sorted(started, key=started.get)
+
+
+def summarize(events: t.List[dict], build: str) -> t.Dict[str, dict]:
+    """Totals per stage of one build, in the order stages first started"""
+    summary = {}
+    for event in sorted((e for e in events if e["build"] == build), key=lambda e: e["start"]):
+        totals = summary.setdefault(
+            event["stage"], {"parent": event["parent"], "runs": 0, "errors": 0, "seconds": 0.0, "cpu": 0.0, **dict.fromkeys(COUNTERS, 0)}
+        )
+        totals["runs"] += 1
+        totals["errors"] += event["status"] != "ok"
+        for key in ("seconds", "cpu", *COUNTERS):
+            totals[key] += event.get(key, 0)
+    return summary
+
+
+def print_summary(summary: t.Dict[str, dict], build: str):
+    print(f"Build {build}")
+    print(f"{'stage':<24} {'runs':>5} {'seconds':>9} {'cpu':>9} {'files':>7} {'in':>9} {'out':>9} {'hits':>6} {'misses':>6}")
+    for name, s in summary.items():
+        label = f"  {name}" if s["parent"] else name
+        print(
+            f"{label:<24} {s['runs']:>5} {s['seconds']:>9.2f} {s['cpu']:>9.2f} {s['files']:>7} "
+            f"{human_size(s['bytes_in']):>9} {human_size(s['bytes_out']):>9} {s['cache_hits']:>6} {s['cache_misses']:>6}"
+        )
+
+
+def compare_builds(events: t.List[dict], build_ids: t.List[str], threshold: float = 0.2) -> t.Dict[str, dict]:
+    """Seconds and output bytes per stage across builds, flagging stages the last build slowed down
+
+    A stage regressed when it took more than `threshold` longer than in the first build compared.
+    """
+    summaries = {build: summarize(events, build) for build in build_ids}
+    stages = list(dict.fromkeys(name for summary in summaries.values() for name in summary))
+    print(f"{'stage':<24} " + " ".join(f"{build[:15]:>15}" for build in build_ids))
+    comparison = {}
+    for name in stages:
+        runs = [summaries[build].get(name) for build in build_ids]
+        seconds = [r["seconds"] if r else None for r in runs]
+        regressed = bool(seconds[0] and seconds[-1] and seconds[-1] > seconds[0] * (1 + threshold))
+        comparison[name] = {"seconds": seconds, "bytes_out": [r["bytes_out"] if r else None for r in runs], "regressed": regressed}
+        cells = " ".join(f"{s:>14.2f}s" if s is not None else f"{'-':>15}" for s in seconds)
+        print(f"{name:<24} {cells}{'  REGRESSED' if regressed else ''}")
+    return comparison
@@ -10,6 +10,7 @@ from aws_cdk.aws_logs import LogGroup, RetentionDays
 from constructs import Construct
 
 from lambda_layers_testing import layer
+from lambda_layers_testing.planner import LayerPlanner
 
 app_code = Code.from_inline(
     """
@@ -29,14 +30,18 @@ def handler(event, context):
 class PublishLayers(Stack):
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
+        # all six layers are built together, transforming each model file once
+        planner = LayerPlanner()
         layer.Boto3Layer(
             self,
             "AllServices",
+            planner=planner,
             layer_name="all-services",
         )
         layer.Boto3Layer(
             self,
             "AllServicesPickled",
+            planner=planner,
             layer_name="all-pickled",
             pickle_data=True,
         )
@@ -45,12 +50,14 @@ class PublishLayers(Stack):
             "CognitoHook",
             boto3_version="1.18.43",
             pickle_data=True,
+            planner=planner,
             layer_name="cognito-hooks",
             only_services=("dynamodb", "cognito-identity", "cognito-idp"),
         )
         layer.Boto3Layer(
             self,
             "Serverless",
+            planner=planner,
             layer_name="serverless-basics",
             only_services=(
                 "dynamodb",
@@ -64,6 +71,7 @@ class PublishLayers(Stack):
         layer.Boto3Layer(
             self,
             "ServerlessKitchenSink",
+            planner=planner,
             layer_name="serverless-sink",
             pickle_data=True,
             only_services=(
@@ -98,12 +106,14 @@ class PublishLayers(Stack):
         layer.Boto3Layer(
             self,
             "SfResume",
+            planner=planner,
             layer_name="sf-resume",
             only_services=(
                 "stepfunctions",
                 "sqs",
             ),
         )
+        planner.build()
 
 
 class Stack(Stack):
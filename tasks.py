@@ -1,18 +1,36 @@
-import os
 import shutil
-import subprocess
 import sys
 import time
 from pathlib import Path
 
 from invoke import task
 
+from lambda_layers_testing.benchmark import benchmark_variants, diff_profiles, profile_memory, profile_variants
+from lambda_layers_testing.handler_services import services_for_handlers
 from lambda_layers_testing.layer_processor import (
+    CACHE_DIR,
     build_botocore_zip,
+    build_runtimes,
+    bundle_service_models,
+    cache_client_classes,
+    cache_models,
+    compile_bytecode,
+    compare_bundle_latency,
+    compare_split_models,
+    compare_zip_levels,
+    encode_service_models,
+    measure_codecs,
+    measure_interning,
     pickle_service_json,
+    precompute_endpoints,
+    reduce_model_memory,
     rewrite_loaders_for_caching,
     rewrite_loaders_for_pickling,
+    shake_modules,
+    split_service_models,
+    target_python_versions,
 )
+from lambda_layers_testing.telemetry import EVENTS_PATH, builds, compare_builds, load_events, print_summary, summarize
 
 PY_VER = f"python{sys.version_info.major}.{sys.version_info.minor}"
 
@@ -25,6 +43,16 @@ def clean(ctx):
         pass
 
 
+@task
+def clean_cache(ctx):
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
+
+@task(iterable=["source"])
+def handler_services(ctx, source):
+    print(",".join(services_for_handlers(source)))
+
+
 @task
 def all_services_zipped(ctx):
     build_botocore_zip("all-services")
@@ -77,59 +105,168 @@ def sls_services_pickled(ctx):
     pickle_service_json(stripped)
 
 
-@task(pre=[clean, all_services_pickled, sls_services_pickled])
-def benchmark_everything(ctx):
-    durations = []
-    (Path(__file__).parent / "profiles").mkdir(exist_ok=True)
-    for d in (
-        "all-services",
-        "all-services-dedented",
-        "all-services-dedented-docless",
-        "all-services-orig",
-        "all-services-pickles",
-        "stripped-pickles",
+@task
+def compare_codecs(ctx, repeat=3):
+    all_services, _ = build_botocore_zip("all-services", snapshots=False)
+    measure_codecs(all_services, repeat=int(repeat))
+
+
+@task
+def compare_bundle(ctx, services="ec2,s3,iam", repeat=5):
+    all_services, _ = build_botocore_zip("all-services")
+    pickled = pickle_service_json(all_services)
+    compare_bundle_latency(pickled, bundle_service_models(pickled, "pickle"), services=services.split(","), repeat=int(repeat))
+
+
+@task
+def compare_split(ctx, services="ec2", repeat=5):
+    all_services, _ = build_botocore_zip("all-services")
+    pickled = pickle_service_json(all_services)
+    compare_split_models(pickled, split_service_models(pickled, "pickle"), services=services.split(","), repeat=int(repeat))
+
+
+@task
+def compare_bytecode(ctx, runs=10, python=sys.executable):
+    stripped, _ = build_botocore_zip("stripped", only_services=["iam", "s3", "dynamodb", "sts", "sqs", "sns"], snapshots=False)
+    compiled = compile_bytecode(stripped, pythons=[python])
+    benchmark_variants({"source": stripped, "compiled": compiled}, runs=int(runs), python=python)
+
+
+@task
+def compare_zips(ctx, repeat=5):
+    stripped, _ = build_botocore_zip("stripped", only_services=["iam", "s3", "dynamodb", "sts", "sqs", "sns"], snapshots=False)
+    pickled = pickle_service_json(stripped)
+    compare_zip_levels(pickled, repeat=int(repeat), report_path=f"{pickled}.zips.json")
+
+
+@task(iterable=["python"])
+def multi_runtime(ctx, python, codec="pickle"):
+    pythons = python or [sys.executable]
+    stripped, _ = build_botocore_zip(
         "stripped",
-    ):
-
-        mod_path = str((Path(__file__).parent / f"cdk.out/layers/{d}/python/lib/{PY_VER}/site-packages/").resolve())
-        args = [
-            "sudo",
-            os.path.expanduser("~/Code/py-spy/target/release/py-spy"),
-            "record",
-            "--rate",
-            "500",
-            "-f",
-            "speedscope",
-            "-o",
-            f"profiles/{d}-out.json",
-            "--",
-            "/usr/local/bin/python3.9",
-            "perf_dummy.py",
-            mod_path,
-        ]
-        print(" ".join(args))
-        now = time.time()
-        subprocess.check_call(args)
-        args = [
-            "sudo",
-            os.path.expanduser("~/Code/py-spy/target/release/py-spy"),
-            "record",
-            "--rate",
-            "500",
-            "-o",
-            f"profiles/{d}-out.svg",
-            "--",
-            "/usr/local/bin/python3.9",
-            "perf_dummy.py",
-            mod_path,
-        ]
-        print(" ".join(args))
-        now = time.time()
-        subprocess.check_call(args)
-        durations.append(f"{d} ran in {1000*(time.time() - now):.2f}ms")
-
-    for d in durations:
-        print(d)
+        only_services=["iam", "s3", "dynamodb", "sts", "sqs", "sns"],
+        snapshots=False,
+        python_versions=target_python_versions(pythons),
+    )
+    if codec != "json":
+        stripped = encode_service_models(stripped, codec)
+    compile_bytecode(build_runtimes(stripped, pythons, codec), pythons)
+
+
+@task
+def compare_model_cache(ctx, runs=10, maxsize=64):
+    stripped, _ = build_botocore_zip("stripped", only_services=["ec2", "firehose", "iam", "sts"], snapshots=False)
+    cached = cache_models(stripped, int(maxsize))
+    benchmark_variants(
+        {"instance-cache": stripped, "process-cache": cached}, runs=int(runs), report_path=f"profiles/model-cache-{int(time.time())}.json"
+    )
+
+
+@task
+def compare_class_cache(ctx, runs=10):
+    stripped, _ = build_botocore_zip("stripped", only_services=["ec2", "firehose", "iam", "sts"], snapshots=False)
+    models = cache_models(stripped)
+    classes = cache_client_classes(models)
+    benchmark_variants(
+        {"model-cache": models, "model+class-cache": classes}, runs=int(runs), report_path=f"profiles/class-cache-{int(time.time())}.json"
+    )
+
+
+@task
+def compare_interning(ctx, runs=10, services="ec2,s3,iam"):
+    stripped, _ = build_botocore_zip("stripped", only_services=["ec2", "firehose", "iam", "s3", "sts"], snapshots=False)
+    measure_interning(stripped, services=services.split(","))
+    benchmark_variants(
+        {"pickles": encode_service_models(stripped, "pickle"), "interned": encode_service_models(stripped, "interned")},
+        runs=int(runs),
+        report_path=f"profiles/interning-{int(time.time())}.json",
+    )
+
+
+@task
+def compare_memory(ctx, runs=10, services="ec2,firehose,iam"):
+    stripped, _ = build_botocore_zip("stripped", only_services=["ec2", "firehose", "iam", "sts"], snapshots=False)
+    pickles = encode_service_models(stripped, "pickle")
+    interned = split_service_models(encode_service_models(stripped, "interned"), "interned")
+    variants = {
+        "pickles": pickles,
+        "pickles-low-memory": reduce_model_memory(pickles),
+        "interned-split": interned,
+        "interned-split-low-memory": reduce_model_memory(interned),
+    }
+    stamp = int(time.time())
+    for label, root in variants.items():
+        print(label)
+        profile_memory(root, services=services.split(","), report_path=f"profiles/memory-{label}-{stamp}.json")
+    benchmark_variants(variants, runs=int(runs), report_path=f"profiles/low-memory-{stamp}.json")
+
+
+@task
+def compare_endpoints(ctx, runs=10, region="us-west-2"):
+    stripped, _ = build_botocore_zip("stripped", only_services=["ec2", "firehose", "iam", "s3", "sts"], snapshots=False)
+    pickles = encode_service_models(stripped, "pickle")
+    endpoints = precompute_endpoints(pickles, [region])
+    benchmark_variants(
+        {"pickles": pickles, "endpoint-table": endpoints},
+        runs=int(runs),
+        region=region,
+        report_path=f"profiles/endpoints-{int(time.time())}.json",
+    )
+
+
+@task
+def compare_incremental(ctx):
+    # a full rebuild neither reads nor fills the model store, so an untimed incremental build warms it first
+    for label, incremental in (("warm-up", True), ("full", False), ("incremental", True)):
+        start = time.perf_counter()
+        all_services, _ = build_botocore_zip("all-services", snapshots=False, incremental=incremental)
+        encode_service_models(all_services, "pickle", snapshot=False, incremental=incremental)
+        if label != "warm-up":
+            print(f"{label} rebuild took {time.perf_counter() - start:.2f}s")
+
+
+@task
+def build_report(ctx, events=str(EVENTS_PATH), last=1, build=None):
+    # one build's stages, or how the last `last` builds compare stage by stage
+    recorded = load_events(events)
+    build_ids = builds(recorded)
+    if not build_ids:
+        print(f"No builds recorded in {events}")
+    elif build or int(last) == 1:
+        build = build or build_ids[-1]
+        print_summary(summarize(recorded, build), build)
+    else:
+        compare_builds(recorded, build_ids[-int(last) :])
+
+
+@task
+def shake_stripped(ctx, script="perf_dummy.py"):
+    stripped, _ = build_botocore_zip("stripped", only_services=["ec2", "firehose", "iam", "sts"], snapshots=False)
+    shake_modules(stripped, workloads=[script])
+
+
+@task(pre=[clean, all_services_pickled, sls_services_pickled])
+def benchmark_everything(ctx, runs=20, python=sys.executable):
+    variants = {
+        d: Path(__file__).parent / "cdk.out" / "layers" / d
+        for d in (
+            "all-services",
+            "all-services-dedented",
+            "all-services-dedented-docless",
+            "all-services-orig",
+            "all-services-pickles",
+            "stripped-pickles",
+            "stripped",
+        )
+    }
+    benchmark_variants(variants, runs=int(runs), python=python, report_path=f"profiles/benchmark-{int(time.time())}.json")
+
+
+@task(pre=[clean, all_services_pickled])
+def profile_io(ctx, before="all-services", after="all-services-pickles", runs=5):
+    layers = Path(__file__).parent / "cdk.out" / "layers"
+    profiles = profile_variants({before: layers / before, after: layers / after}, "profiles", runs=int(runs))
+    diff_profiles(profiles[before], profiles[after])
 
 
 @task
@@ -0,0 +1,51 @@
+import hashlib
+import zipfile
+
+from lambda_layers_testing import installer
+
+EPOCH = (2020, 1, 1, 0, 0, 0)
+
+
+def _wheel(wheelhouse, name, version, requires_python=None, requires=()):
+    path = wheelhouse / f"{name}-{version}-py3-none-any.whl"
+    dist_info = f"{name}-{version}.dist-info"
+    metadata = [f"Name: {name}", f"Version: {version}", *(f"Requires-Dist: {r}" for r in requires)]
+    if requires_python:
+        metadata.append(f"Requires-Python: {requires_python}")
+    # fixed timestamps, so the same wheel built twice has the same sha256
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr(zipfile.ZipInfo(f"{name}/__init__.py", EPOCH), "")
+        archive.writestr(zipfile.ZipInfo(f"{dist_info}/METADATA", EPOCH), "\n".join(metadata) + "\n")
+        archive.writestr(zipfile.ZipInfo(f"{dist_info}/RECORD", EPOCH), "")
+    return path
+
+
+def _pin(wheel):
+    name, version = wheel.name.split("-")[:2]
+    return f"{name}=={version} --hash=sha256:{hashlib.sha256(wheel.read_bytes()).hexdigest()}\n"
+
+
+def test_download_runs_for_every_target_python(tmp_path, monkeypatch):
+    wheelhouse = tmp_path / "wheels"
+    wheelhouse.mkdir()
+    _wheel(wheelhouse, "boto3", "1.26.0", ">=3.7", ["jmespath<2.0.0,>=0.7.1"])
+    _wheel(wheelhouse, "jmespath", "1.1.0", ">=3.9")
+    downloads = []
+
+    def pip(command, cwd):
+        # stands in for pip download, which only finds the older jmespath when resolving for 3.8
+        version = command[command.index("--python-version") + 1]
+        downloads.append((version, command[command.index("--platform") + 1], command[-1]))
+        if version == "3.8":
+            _wheel(wheelhouse, "jmespath", "1.0.1", ">=3.7")
+
+    monkeypatch.setattr(installer, "check_output", pip)
+    monkeypatch.setattr(installer, "INSTALL_ROOT", tmp_path)
+    pins = tmp_path / "requirements.txt"
+    pins.write_text(_pin(wheelhouse / "boto3-1.26.0-py3-none-any.whl") + _pin(_wheel(tmp_path, "jmespath", "1.0.1", ">=3.7")))
+
+    package_dir = installer.install("1.26.0", wheelhouse, offline=False, python_versions=["3.11", "3.8"], hashes=pins)
+
+    assert downloads == [("3.11", installer.PLATFORM, "boto3==1.26.0"), ("3.8", installer.PLATFORM, "boto3==1.26.0")]
+    assert package_dir == tmp_path / "pkg_boto3_1.26.0-py3.11-3.8"
+    assert (package_dir / "jmespath-1.0.1.dist-info").is_dir()
@@ -0,0 +1,58 @@
+import copy
+import pickle
+
+import pytest
+
+from lambda_layers_testing import layer_processor
+
+LOADER = """
+import json
+class Loader:
+    def load(self, path):
+        return self.file_loader.load_file(path)
+"""
+
+SHAPES = {f"Shape{i}": {"type": "string", "documentation": str(i)} for i in range(5)}
+
+
+@pytest.fixture
+def shapes(tmp_path):
+    codec = layer_processor.CODECS["pickle"]
+    model_file = tmp_path / f"service-2{codec.suffix}"
+    model_file.write_bytes(codec.dumps({"operations": {}, "shapes": SHAPES}))
+    layer_processor.split_service_model(model_file, codec, chunk_size=2)
+    namespace = {}
+    exec(layer_processor.rewrite_loaders_for_split(LOADER, "pickle"), namespace)
+    model = namespace["with_lazy_shapes"](codec.loads(model_file.read_bytes()), str(model_file)[: -len(codec.suffix)])
+    return model["shapes"]
+
+
+def test_lazy_shapes_decode_on_lookup(shapes):
+    assert len(shapes) == len(SHAPES)
+    assert dict.__len__(shapes) == 0
+    assert shapes["Shape3"] == SHAPES["Shape3"]
+    assert dict.__len__(shapes) == 2
+    assert sorted(shapes) == sorted(SHAPES)
+    assert shapes == SHAPES and not shapes != SHAPES
+
+
+def test_lazy_shapes_copy_and_pickle_as_plain_dicts(shapes):
+    for copied in (copy.deepcopy(shapes), pickle.loads(pickle.dumps(shapes)), copy.copy(shapes)):
+        assert type(copied) is dict
+        assert copied == SHAPES
+
+
+def test_lazy_shapes_pop(shapes):
+    assert shapes.pop("Shape0") == SHAPES["Shape0"]
+    assert "Shape0" not in shapes
+    # Shape1 shares Shape0's chunk, which was decoded without bringing Shape0 back
+    assert shapes["Shape1"] == SHAPES["Shape1"]
+    assert "Shape0" not in shapes
+    assert shapes.pop("Shape0", None) is None
+    del shapes["Shape4"]
+    shapes.setdefault("Shape2", "kept")
+    shapes.update(Shape5={"type": "integer"})
+    assert sorted(shapes) == ["Shape1", "Shape2", "Shape3", "Shape5"]
+    assert shapes["Shape2"] == SHAPES["Shape2"]
+    with pytest.raises(KeyError):
+        shapes.pop("Shape4")
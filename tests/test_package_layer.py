@@ -0,0 +1,41 @@
+import subprocess
+import sys
+import zipfile
+
+import pytest
+
+from lambda_layers_testing import installer, layer_processor
+
+RESOURCE_PROBE = "import sys; sys.path.insert(0, sys.argv[1]); import boto3; boto3.Session(region_name='us-east-1').resource('s3')"
+
+
+@pytest.fixture(scope="module")
+def boto3_installed():
+    try:
+        return installer.install()
+    except (LookupError, OSError, ValueError, subprocess.CalledProcessError) as e:
+        pytest.skip(f"boto3 can't be installed here: {e}")
+
+
+def test_package_layer_keeps_empty_directories(tmp_path):
+    layer_root = tmp_path / "layer"
+    (layer_root / "python" / "boto3" / "data").mkdir(parents=True)
+    (layer_root / "python" / "boto3" / "__init__.py").write_text("")
+    zip_path = layer_processor.package_layer(layer_root)
+    with zipfile.ZipFile(zip_path) as archive:
+        names = archive.namelist()
+        assert names == ["python/", "python/boto3/", "python/boto3/__init__.py", "python/boto3/data/"]
+        assert archive.getinfo("python/boto3/data/").is_dir()
+    first = zip_path.read_bytes()
+    assert layer_processor.package_layer(layer_root).read_bytes() == first
+
+
+def test_packaged_bundled_layer_builds_resources(boto3_installed, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    zip_path, _ = layer_processor.build_layer(
+        "bundled", only_services=["s3", "sts"], codec="pickle", bundle=True, package=True, use_cache=False
+    )
+    with zipfile.ZipFile(zip_path) as archive:
+        archive.extractall(tmp_path / "unzipped")
+    site_packages = tmp_path / "unzipped" / "python" / "lib" / layer_processor.PY_VER / "site-packages"
+    subprocess.run([sys.executable, "-I", "-S", "-c", RESOURCE_PROBE, str(site_packages)], check=True)